@@ -227,6 +227,8 @@ class AdvancedWizardForm(forms.ModelForm):
             "num_users_irr",
             "batch_size",
             "classifier",
+            "vectorizer",
+            "prediction_top_k",
         ]
 
     use_active_learning = forms.BooleanField(initial=False, required=False)
@@ -252,6 +254,13 @@ class AdvancedWizardForm(forms.ModelForm):
         initial="logistic regression",
         required=False,
     )
+    vectorizer = forms.ChoiceField(
+        widget=RadioSelect(),
+        choices=Project.VECTORIZER_CHOICES,
+        initial="tfidf",
+        required=False,
+    )
+    prediction_top_k = forms.IntegerField(min_value=1, required=False)
 
     allow_coders_view_labels = forms.BooleanField(initial=False, required=False)
 
@@ -269,6 +278,18 @@ class AdvancedWizardForm(forms.ModelForm):
         if not use_model:
             self.cleaned_data["classifier"] = None
             self.cleaned_data["learning_method"] = "random"
+        if not self.cleaned_data.get("vectorizer"):
+            self.cleaned_data["vectorizer"] = "tfidf"
+        # Gaussian Naive Bayes needs dense features, which the fixed size feature
+        # space of the hashing vectorizers is far too wide for
+        if (
+            self.cleaned_data["classifier"] == "gnb"
+            and self.cleaned_data["vectorizer"] != "tfidf"
+        ):
+            self.add_error(
+                "vectorizer",
+                "Gaussian Naive Bayes can only be used with the TF-IDF vectorizer.",
+            )
 
         if use_default_batch_size:
             self.cleaned_data["batch_size"] = 0
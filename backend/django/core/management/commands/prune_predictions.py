@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from core import tasks
+from core.models import Project
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes the predictions and uncertainty scores of all but the most recent "
+        "models of projects."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "project_pks",
+            nargs="*",
+            type=int,
+            help="Projects to prune. All projects with a model are pruned if empty.",
+        )
+        parser.add_argument(
+            "--keep",
+            type=int,
+            default=None,
+            help="Number of recent models to keep predictions for.",
+        )
+
+    def handle(self, *args, **options):
+        project_pks = options["project_pks"]
+        if len(project_pks) == 0:
+            project_pks = Project.objects.filter(classifier__isnull=False).values_list(
+                "pk", flat=True
+            )
+        for pk in project_pks:
+            try:
+                num_deleted = tasks.send_prune_predictions_task.apply(
+                    args=[pk], kwargs={"keep_models": options["keep"]}
+                ).get()
+                print("Deleted", num_deleted, "old prediction rows for project", pk)
+            except Exception as e:
+                print("ERROR:", e)
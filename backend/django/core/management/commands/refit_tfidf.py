@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from core import tasks
+from core.models import Project
+
+
+class Command(BaseCommand):
+    help = "Refits the tf-idf vectorizer and rebuilds the tf-idf matrix of projects."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "project_pks",
+            nargs="*",
+            type=int,
+            help="Projects to refit. All projects with a model are refit if empty.",
+        )
+
+    def handle(self, *args, **options):
+        project_pks = options["project_pks"]
+        if len(project_pks) == 0:
+            project_pks = Project.objects.filter(classifier__isnull=False).values_list(
+                "pk", flat=True
+            )
+        for pk in project_pks:
+            print("Refitting tf-idf for project", pk)
+            try:
+                tasks.send_tfidf_creation_task.apply(
+                    args=[pk], kwargs={"refit": True}
+                ).get()
+            except Exception as e:
+                print("ERROR:", e)
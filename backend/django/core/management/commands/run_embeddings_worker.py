@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.utils.utils_embeddings import serve_embeddings
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the embeddings worker, which answers batched encode requests from the "
+        "web processes when EMBEDDINGS_SERVICE is on."
+    )
+
+    def handle(self, *args, **options):
+        print("Loading the embeddings model")
+        serve_embeddings()
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0079_rename_name_category_field_name_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="project",
+            name="vectorizer",
+            field=models.CharField(
+                choices=[
+                    ("tfidf", "TF-IDF (default)"),
+                    ("hashing", "Hashing (faster for very large datasets)"),
+                    ("hashing tfidf", "Hashing with TF-IDF reweighting"),
+                ],
+                default="tfidf",
+                max_length=13,
+            ),
+        ),
+    ]
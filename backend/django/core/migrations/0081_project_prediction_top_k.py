@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:00
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0080_project_vectorizer"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="project",
+            name="prediction_top_k",
+            field=models.IntegerField(
+                blank=True,
+                null=True,
+                validators=[django.core.validators.MinValueValidator(1)],
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0081_project_prediction_top_k"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="model",
+            name="cv_accuracy",
+            field=models.FloatField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="model",
+            name="cv_metrics",
+            field=models.JSONField(null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0082_alter_model_cv_accuracy_alter_model_cv_metrics"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DataEmbeddings",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("embedding", models.BinaryField()),
+                (
+                    "data",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="dataEmbedding",
+                        to="core.data",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ("data_id",),
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:00
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0083_dataembeddings"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name="label",
+            index=GinIndex(
+                fields=["name"], name="core_label_name_trgm", opclasses=["gin_trgm_ops"]
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="label",
+            index=GinIndex(
+                fields=["description"],
+                name="core_label_description_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="labelmetadata",
+            index=models.Index(
+                fields=["label_metadata_field", "value"],
+                name="core_labelmd_field_value_idx",
+            ),
+        ),
+    ]
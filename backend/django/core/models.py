@@ -1,5 +1,6 @@
 from django.conf import settings
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.db.models import JSONField
@@ -62,6 +63,12 @@ class Project(models.Model):
         ("gnb", "Gaussian Naive Bayes"),
     ]
 
+    VECTORIZER_CHOICES = [
+        ("tfidf", "TF-IDF (default)"),
+        ("hashing", "Hashing (faster for very large datasets)"),
+        ("hashing tfidf", "Hashing with TF-IDF reweighting"),
+    ]
+
     learning_method = models.CharField(
         max_length=15, default="least confident", choices=ACTIVE_L_CHOICES
     )
@@ -71,6 +78,14 @@ class Project(models.Model):
         choices=CLASSIFIER_CHOICES,
         null=True,
     )
+    vectorizer = models.CharField(
+        max_length=13, default="tfidf", choices=VECTORIZER_CHOICES
+    )
+    # only save the predictions of the k most probable labels for each datum, null
+    # saves a prediction for every label
+    prediction_top_k = models.IntegerField(
+        null=True, blank=True, validators=[MinValueValidator(1)]
+    )
 
     DEDUP_CHOICES = (
         ("Text", "Text only"),
@@ -187,8 +202,9 @@ class Model(models.Model):
     pickle_path = models.TextField()
     project = models.ForeignKey("Project", on_delete=models.CASCADE)
     training_set = models.ForeignKey("TrainingSet", on_delete=models.CASCADE)
-    cv_accuracy = models.FloatField()
-    cv_metrics = JSONField()
+    # null until the model has been evaluated
+    cv_accuracy = models.FloatField(null=True)
+    cv_metrics = JSONField(null=True)
     predictions = models.ManyToManyField(
         "Data", related_name="models", through="DataPrediction"
     )
@@ -270,10 +286,32 @@ class LabelEmbeddings(models.Model):
     embedding = ArrayField(models.FloatField())
 
 
+class DataEmbeddings(models.Model):
+    class Meta:
+        ordering = ("data_id",)
+
+    data = models.OneToOneField(
+        "Data", on_delete=models.CASCADE, related_name="dataEmbedding"
+    )
+    # float32 bytes of the embedding of the data text
+    embedding = models.BinaryField()
+
+
 class Label(models.Model):
     class Meta:
         ordering = ("id",)
         unique_together = ("name", "project")
+        # trigram indexes for the substring search of SearchLabelsView
+        indexes = [
+            GinIndex(
+                fields=["name"], name="core_label_name_trgm", opclasses=["gin_trgm_ops"]
+            ),
+            GinIndex(
+                fields=["description"],
+                name="core_label_description_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ]
 
     name = models.TextField()
     project = models.ForeignKey(
@@ -426,6 +464,12 @@ class LabelMetaDataField(models.Model):
 class LabelMetaData(models.Model):
     class Meta:
         unique_together = ("label", "label_metadata_field")
+        indexes = [
+            models.Index(
+                fields=["label_metadata_field", "value"],
+                name="core_labelmd_field_value_idx",
+            )
+        ]
 
     label = models.ForeignKey(
         "Label", on_delete=models.CASCADE, related_name="labelmetadata"
@@ -1,9 +1,12 @@
 from allauth.account.signals import user_logged_out
 from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from core.models import Profile, Project
+from core.models import Model, Profile, Project, Queue
 from core.utils.utils_annotate import leave_coding_page
+from core.utils.utils_model import invalidate_artifact_cache
+from core.utils.utils_queue import invalidate_project_queues
 
 
 @receiver(user_logged_out)
@@ -15,3 +18,17 @@ def on_user_logout(sender, **kwargs):
 
     for project in profile_projects:
         leave_coding_page(profile, project)
+
+
+@receiver(post_save, sender=Model)
+def on_model_created(sender, instance, created, **kwargs):
+    # a new round replaces the cached classifiers of the project
+    if created:
+        invalidate_artifact_cache(instance.project_id, "classifier")
+
+
+@receiver(post_save, sender=Queue)
+@receiver(post_delete, sender=Queue)
+def on_queue_changed(sender, instance, **kwargs):
+    # the eligible queues of pop_nonempty_queues are cached per project
+    invalidate_project_queues(instance.project_id)
@@ -1,6 +1,9 @@
 from __future__ import absolute_import
 
 from celery import shared_task
+from celery.exceptions import Ignore, Retry
+from django.conf import settings
+from django.db import transaction
 
 
 @shared_task
@@ -8,35 +11,117 @@ def send_test_task():
     return "Test Task Complete"
 
 
-@shared_task
-def send_model_task(project_pk):
-    """Trains, Saves, Predicts, Fills Queue."""
+@shared_task(bind=True)
+def send_model_task(self, project_pk):
+    """Trains, Saves, Predicts, Fills Queue.
+
+    The stage reached is published as the task state, see report_training_progress.
+    """
     from core.models import Project, TrainingSet
-    from core.utils.utils_model import predict_data, train_and_save_model
+    from core.utils.utils_model import (
+        is_model_task_cancelled,
+        predict_data,
+        release_model_task,
+        report_training_progress,
+        train_and_save_model,
+    )
+    from core.utils.utils_redis import project_task_slot
 
     project = Project.objects.get(pk=project_pk)
     al_method = project.learning_method
+    training_set = project.get_current_training_set()
+    timings = {}
+
+    def progress(stage, done=None, total=None):
+        report_training_progress(self, training_set, stage, timings, done, total)
+
+    try:
+        with project_task_slot(project_pk) as acquired:
+            if not acquired and not self.request.is_eager:
+                raise self.retry(
+                    countdown=settings.PROJECT_TASK_RETRY_DELAY,
+                    max_retries=settings.PROJECT_TASK_MAX_RETRIES,
+                )
+
+            model = train_and_save_model(project, progress)
+            if al_method != "random":
+                try:
+                    predict_data(project, model, progress)
+                except Ignore:
+                    # superseded, a model without predictions must not be used
+                    model.delete()
+                    raise
+            with transaction.atomic():
+                # supersede_model_task cancels under the same row lock, so a cancel
+                # is either seen here or the new training set is seen there
+                TrainingSet.objects.select_for_update().get(pk=training_set.pk)
+                cancelled = is_model_task_cancelled(training_set, self.request.id)
+                if not cancelled:
+                    TrainingSet.objects.create(
+                        project=project,
+                        set_number=project.get_current_training_set().set_number + 1,
+                    )
+            if cancelled:
+                model.delete()
+                raise Ignore()
+    except (Ignore, Retry):
+        raise
+    except Exception:
+        # a failed task must not block check_and_trigger_model from starting another
+        release_model_task(training_set, self.request.id)
+        raise
+    send_model_evaluation_task.delay(model.pk)
+    send_prune_predictions_task.delay(project_pk)
 
-    model = train_and_save_model(project)
-    if al_method != "random":
-        predict_data(project, model)
-    TrainingSet.objects.create(
-        project=project, set_number=project.get_current_training_set().set_number + 1
-    )
+
+@shared_task
+def send_model_evaluation_task(model_pk, strategy=None):
+    """Estimate and save the metrics of a trained model."""
+    from core.models import Model
+    from core.utils.utils_model import evaluate_model
+
+    evaluate_model(Model.objects.get(pk=model_pk), strategy)
 
 
 @shared_task
-def send_tfidf_creation_task(project_pk):
-    """Create and Save tfidf."""
+def send_prune_predictions_task(project_pk, keep_models=None):
+    """Delete the predictions of all but the most recent models of a project."""
+    from core.models import Project
+    from core.utils.utils_model import prune_old_predictions
+
+    project = Project.objects.get(pk=project_pk)
+    return prune_old_predictions(project, keep_models)
+
+
+@shared_task(bind=True)
+def send_tfidf_creation_task(self, project_pk, refit=False):
+    """Create and Save tfidf.
+
+    Unless a refit is requested, only data added since the last save is vectorized
+    and appended. A full refit still happens when there is no saved matrix yet or
+    the new data has drifted too far from the fitted vocabulary.
+    """
     from core.utils.utils_model import (
         create_tfidf_matrix,
         save_tfidf_matrix,
-        save_tfidf_vectorizer,
+        update_tfidf_matrix,
     )
+    from core.utils.utils_redis import project_task_slot
+
+    with project_task_slot(project_pk) as acquired:
+        if not acquired and not self.request.is_eager:
+            raise self.retry(
+                countdown=settings.PROJECT_TASK_RETRY_DELAY,
+                max_retries=settings.PROJECT_TASK_MAX_RETRIES,
+            )
+
+        if not refit:
+            file = update_tfidf_matrix(project_pk)
+            if file is not None:
+                return file
 
-    tf_idf, vectorizer = create_tfidf_matrix(project_pk)
-    file = save_tfidf_matrix(tf_idf, project_pk)
-    save_tfidf_vectorizer(vectorizer, project_pk)
+        tf_idf, vectorizer = create_tfidf_matrix(project_pk)
+        file = save_tfidf_matrix(tf_idf, project_pk, vectorizer=vectorizer)
 
     return file
 
@@ -48,10 +133,31 @@ def send_label_embeddings_task(project_pk):
     generate_label_embeddings(project_pk)
 
 
+@shared_task(bind=True)
+def send_data_embeddings_task(self, project_pk):
+    """Compute the embeddings of the project data which has none yet."""
+    from core.utils.utils_embeddings import create_data_embeddings
+    from core.utils.utils_redis import project_task_slot
+
+    with project_task_slot(project_pk) as acquired:
+        if not acquired and not self.request.is_eager:
+            raise self.retry(
+                countdown=settings.PROJECT_TASK_RETRY_DELAY,
+                max_retries=settings.PROJECT_TASK_MAX_RETRIES,
+            )
+
+        return create_data_embeddings(project_pk)
+
+
 @shared_task
 def send_check_and_trigger_model_task(project_pk):
+    """Check if the model needs to run after labels were added in bulk.
+
+    The label counter does not see bulk inserts, so it is recounted first.
+    """
     from core.models import Data
-    from core.utils.utils_model import check_and_trigger_model
+    from core.utils.utils_model import check_and_trigger_model, reset_labeled_count
 
     datum = Data.objects.filter(project=project_pk).first()
-    check_and_trigger_model(datum)
+    reset_labeled_count(datum.project.get_current_training_set())
+    return check_and_trigger_model(datum)
@@ -79,6 +79,8 @@ adminpage_patterns = [
     re_path(r"^label_distribution/(?P<project_pk>\d+)/$", api_admin.label_distribution),
     re_path(r"^label_timing/(?P<project_pk>\d+)/$", api_admin.label_timing),
     re_path(r"^model_metrics/(?P<project_pk>\d+)/$", api_admin.model_metrics),
+    re_path(r"^model_progress/(?P<project_pk>\d+)/$", api_admin.model_progress),
+    re_path(r"^cancel_model/(?P<project_pk>\d+)/$", api_admin.cancel_model),
     re_path(r"^data_coded_table/(?P<project_pk>\d+)/$", api_admin.data_coded_table),
     re_path(
         r"^data_predicted_table/(?P<project_pk>\d+)/$", api_admin.data_predicted_table
@@ -11,7 +11,6 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import connection, transaction
 from django.utils import timezone
-from sentence_transformers import SentenceTransformer
 from django.core.exceptions import ValidationError
 
 from core import tasks
@@ -35,6 +34,8 @@ from core.models import (
     LabelMetaData,
     Category,
 )
+from core.utils import utils_embeddings
+from core.utils.utils_label_search import invalidate_label_search_index
 from core.utils.utils_queue import fill_queue
 from smart.settings import TIME_ZONE_FRONTEND
 
@@ -45,13 +46,6 @@ from smart.settings import TIME_ZONE_FRONTEND
 # Disable warning for false positive warning that should only trigger on chained assignment
 pd.options.mode.chained_assignment = None  # default='warn'
 
-# Using a prebuilt model
-# How this model was built: https://github.com/dsteedRTI/csv-to-embeddings-model
-# Sbert Model can be found here: https://www.sbert.net/docs/pretrained_models.html
-# Sbert Model Card: https://huggingface.co/sentence-transformers/multi-qa-mpnet-base-dot-v1
-model_path = "core/smart_embeddings_model"
-embeddings_model = SentenceTransformer(model_path)
-
 
 def md5_hash(obj):
     """Return MD5 hash hexdigest of obj; returns None if obj is None."""
@@ -103,9 +97,10 @@ def upload_data(form_data, project, queue=None, irr_queue=None, batch_size=30):
 
     1. Add data to database
     2. If new project then fill queue (only new project will pass queue object)
-    3. Save the uploaded data file
-    4. Create tf_idf file
-    5. Check and Trigger model
+    3. Compute the label and data embeddings
+    4. Save the uploaded data file
+    5. Create tf_idf file
+    6. Check and Trigger model
     """
 
     new_df = add_data(project, form_data)
@@ -132,6 +127,10 @@ def upload_data(form_data, project, queue=None, irr_queue=None, batch_size=30):
     #     )
     # )
     tasks.send_label_embeddings_task(project.pk)
+    # the data embeddings used for label suggestions are computed in the background
+    transaction.on_commit(
+        lambda: tasks.send_data_embeddings_task.apply_async(args=[project.pk])
+    )
 
     # Since User can upload Labeled Data and this data is added to current training_set
     # we need to check_and_trigger model.  However since training model requires
@@ -279,27 +278,30 @@ def create_metadata_objects_from_csv(df, project):
 
 
 def generate_label_embeddings(project):
-    """Create embeddings for each description of label."""
+    """Create embeddings for each description of label which has none yet."""
 
     project_labels = Label.objects.filter(project=project)
 
     if len(project_labels) > 5:
-        project_labels_descriptions = list(
-            project_labels.values_list("description", flat=True)
-        )
+        new_labels = list(project_labels.filter(labelEmbedding__isnull=True))
+        if len(new_labels) == 0:
+            return
 
         # Make manual embeddings. Prod settings made calling the api from the backend infeasible
-        embeddings = embeddings_model.encode(project_labels_descriptions)
+        embeddings = utils_embeddings.encode(
+            [label.description for label in new_labels], service=False
+        )
 
         # We have to use tolist() since not calling API now to handle numpy arrays
         # (JSON response from API originally handled this for us)
         label_embeddings = [
             LabelEmbeddings(embedding=embedding.tolist(), label=label)
-            for embedding, label in zip(embeddings, project_labels)
+            for embedding, label in zip(embeddings, new_labels)
         ]
         LabelEmbeddings.objects.bulk_create(
             label_embeddings, ignore_conflicts=True, batch_size=8000
         )
+        utils_embeddings.invalidate_label_embeddings(new_labels[0].project_id)
 
 
 def update_label_embeddings(project):
@@ -314,7 +316,7 @@ def update_label_embeddings(project):
         project_labels_ids = list(project_labels.values_list("id", flat=True))
 
         # Make manual embeddings. Prod settings made calling the api from the backend infeasible
-        embeddings = embeddings_model.encode(project_labels_descriptions)
+        embeddings = utils_embeddings.encode(project_labels_descriptions, service=False)
 
         project_labels_embeddings = LabelEmbeddings.objects.filter(
             label_id__in=project_labels_ids
@@ -328,6 +330,7 @@ def update_label_embeddings(project):
         LabelEmbeddings.objects.bulk_update(
             project_labels_embeddings, ["embedding"], batch_size=8000
         )
+        utils_embeddings.invalidate_label_embeddings(project.pk)
 
 
 def add_data(project, df):
@@ -928,6 +931,9 @@ def create_or_update_project_category(project, new_category):
                 field_name__iexact=new_category, project=project
             ),
         )
+    # the label search and suggestions filter on the category
+    invalidate_label_search_index(project.pk)
+    utils_embeddings.invalidate_label_embeddings(project.pk)
 
 
 def update_label_descriptions_metadata(project, new_data):
@@ -994,3 +1000,4 @@ def update_label_descriptions_metadata(project, new_data):
     )
     if len(metadata_both) > 0:
         create_or_update_project_category(project, metadata_both[0])
+    invalidate_label_search_index(project.pk)
@@ -1,7 +1,7 @@
+from collections import deque
 from random import randrange
 
 from django.conf import settings
-from django.core.cache import cache
 from django.db import transaction
 from django.utils import timezone
 
@@ -19,9 +19,11 @@ from core.models import (
     VerifiedDataLabel,
 )
 from core.templatetags import project_extras
-from core.utils.utils_queue import pop_first_nonempty_queue
+from core.utils.utils_model import reset_labeled_count
+from core.utils.utils_queue import get_irr_candidates, pop_nonempty_queues
 from core.utils.utils_redis import (
     redis_serialize_data,
+    redis_serialize_irr_seen,
     redis_serialize_queue,
     redis_serialize_set,
 )
@@ -44,14 +46,22 @@ def assign_datum(profile, project, type="normal"):
     """Given a profile and project, figure out which queue to pull from; then pop a
     datum off that queue and assign it to the profile."""
     with transaction.atomic():
-        queue, datum = pop_first_nonempty_queue(project, profile=profile, type=type)
-        if datum is None:
+        if type == "irr":
+            popped = get_irr_candidates(project, profile, 1)
+        else:
+            popped = pop_nonempty_queues(project, 1, profile=profile)
+        if len(popped) == 0:
             return None
         else:
-            num_labeled = DataLabel.objects.filter(data=datum, profile=profile).count()
+            queue_pk, data_pk = popped[0]
+            num_labeled = DataLabel.objects.filter(
+                data_id=data_pk, profile=profile
+            ).count()
             if num_labeled == 0:
-                AssignedData.objects.create(data=datum, profile=profile, queue=queue)
-                return datum
+                AssignedData.objects.create(
+                    data_id=data_pk, profile=profile, queue_id=queue_pk
+                )
+                return Data.objects.get(pk=data_pk)
             else:
                 return None
 
@@ -91,40 +101,87 @@ def get_assignments(profile, project, num_assignments):
             assignment.data for assignment in existing_assignments[:num_assignments]
         ]
     else:
-        data = []
-
-        for i in range(num_assignments):
-            # if there is IRR, with some probability get an IRR item
-            rand_choice = randrange(0, 101)
-            if project.percentage_irr > 0 and rand_choice <= project.percentage_irr:
-                assigned_datum = assign_datum(profile, project, type="irr")
-                if assigned_datum is None:
-                    # no irr data found
-                    assigned_datum = assign_datum(profile, project)
-            else:
-                # get normal data
-                assigned_datum = assign_datum(profile, project)
-                if assigned_datum is None:
-                    # no non-irr data found so checking for irr
-                    assigned_datum = assign_datum(profile, project, type="irr")
-            if assigned_datum is None:
-                break
+        return assign_data(profile, project, num_assignments)
+
+
+def assign_data(profile, project, num_assignments):
+    """Assign up to num_assignments new data to a profile in one batch.
+
+    Each assignment is IRR data with probability project.percentage_irr, falling back
+    to normal data if there is no IRR data left and the other way around.  The normal
+    data is popped with a single redis call, fetched with a single query and
+    assigned with a single insert.
+
+    Args:
+        profile: Profile object
+        project: Project object
+        num_assignments: the number of data to assign
+    Returns:
+        list of the assigned Data objects
+    """
+    # with some probability each assignment should be an IRR item
+    irr_choices = [
+        project.percentage_irr > 0 and randrange(0, 101) <= project.percentage_irr
+        for i in range(num_assignments)
+    ]
+
+    with transaction.atomic():
+        # IRR candidates are marked as seen when they are returned, so only ask for
+        # as many as will be assigned
+        irr_data = deque(get_irr_candidates(project, profile, sum(irr_choices)))
+        num_normal = num_assignments - len(irr_data)
+        popped = pop_nonempty_queues(project, num_normal, profile=profile)
+        labeled = set(
+            DataLabel.objects.filter(
+                profile=profile, data_id__in=[data_pk for _, data_pk in popped]
+            ).values_list("data_id", flat=True)
+        )
+        normal_data = deque(p for p in popped if p[1] not in labeled)
+
+        # fall back to IRR data if there is not enough normal data left
+        shortfall = num_normal - len(normal_data)
+        if shortfall > 0:
+            irr_data.extend(get_irr_candidates(project, profile, shortfall))
 
-            data.append(assigned_datum)
-        return data
+        assignments = []
+        for is_irr in irr_choices:
+            preferred, other = (
+                (irr_data, normal_data) if is_irr else (normal_data, irr_data)
+            )
+            source = preferred if len(preferred) > 0 else other
+            if len(source) == 0:
+                break
+            assignments.append(source.popleft())
+
+        data = Data.objects.in_bulk([data_pk for _, data_pk in assignments])
+        assignments = [(q, d) for q, d in assignments if d in data]
+        AssignedData.objects.bulk_create(
+            [
+                AssignedData(data_id=data_pk, profile=profile, queue_id=queue_pk)
+                for queue_pk, data_pk in assignments
+            ]
+        )
+    return [data[data_pk] for _, data_pk in assignments]
 
 
 def unassign_datum(datum, profile):
     """Remove a profile's assignment to a datum.
 
-    Re-add the datum to its respective queue in Redis.
+    Re-add the datum to its respective queue in Redis.  IRR data never left its
+    queue, so it is removed from the profile's seen set instead.
     """
     assignment = AssignedData.objects.filter(profile=profile, data=datum).get()
 
     queue = assignment.queue
     assignment.delete()
 
-    settings.REDIS.lpush(redis_serialize_queue(queue), redis_serialize_data(datum))
+    if queue.type == "irr":
+        settings.REDIS.srem(
+            redis_serialize_irr_seen(queue.pk, profile.pk),
+            redis_serialize_data(datum),
+        )
+    else:
+        settings.REDIS.lpush(redis_serialize_queue(queue), redis_serialize_data(datum))
 
 
 def batch_unassign(profile):
@@ -253,6 +310,8 @@ def process_irr_label(data, label):
                     verified_by=project.creator,
                 )
                 DataQueue.objects.filter(data=data).delete()
+                # the resolved label is not counted by check_and_trigger_model
+                transaction.on_commit(lambda: reset_labeled_count(current_training_set))
             else:
                 agree = False
                 # if they don't, update the data into the admin queue
@@ -299,20 +358,6 @@ def createUnresolvedAdjudicateMessage(project, data, message):
     AdjudicateDescription.objects.create(project=project, data=data, message=message)
 
 
-def cache_embeddings(project_pk, embeddings_category, embeddings):
-    key = project_pk
-    if embeddings_category is not None:
-        key += embeddings_category.replace(" ", "_")
-    cache.set(key, embeddings)
-
-
-def get_embeddings(project_pk, embeddings_category):
-    key = project_pk
-    if embeddings_category is not None:
-        key += embeddings_category.replace(" ", "_")
-    return cache.get(key)
-
-
 def update_last_action(project, profile):
     admin_qs = AdminProgress.objects.filter(project=project, profile=profile)
     if admin_qs.exists():
@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread-safe, process-level LRU cache of values tagged with a stamp.
+
+    The stamp identifies the version of the value, such as a version string from
+    redis or the modification time of a file, and a lookup with a different stamp
+    is a miss.  Once the cached values weigh more than max_size the least recently
+    used ones are dropped.  Without a weigh function every value weighs one, so
+    max_size is the number of values kept.
+
+    Args:
+        max_size: the total weight of the values kept
+        weigh: optional function taking a value, returning its weight
+    """
+
+    def __init__(self, max_size, weigh=None):
+        self.max_size = max_size
+        self.weigh = weigh or (lambda value: 1)
+        self._values = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, stamp):
+        """Return the value cached under a key with the given stamp, otherwise None."""
+        with self._lock:
+            cached = self._values.get(key)
+            if cached is None or cached[0] != stamp:
+                return None
+            self._values.move_to_end(key)
+            return cached[1]
+
+    def set(self, key, stamp, value):
+        """Cache a value under a key, dropping the least recently used values.
+
+        A value weighing more than max_size on its own is not cached.
+        """
+        weight = self.weigh(value)
+        with self._lock:
+            self._pop(key)
+            if weight > self.max_size:
+                return
+            self._values[key] = (stamp, value, weight)
+            self._size += weight
+            while self._size > self.max_size:
+                self._pop(next(iter(self._values)))
+
+    def discard(self, match):
+        """Drop the values whose key matches.
+
+        Args:
+            match: function taking a key, returning True for the keys to drop
+        """
+        with self._lock:
+            for key in list(self._values):
+                if match(key):
+                    self._pop(key)
+
+    def _pop(self, key):
+        cached = self._values.pop(key, None)
+        if cached is not None:
+            self._size -= cached[2]
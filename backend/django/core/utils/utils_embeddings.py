@@ -0,0 +1,571 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+
+from core.models import (
+    Data,
+    DataEmbeddings,
+    Label,
+    LabelEmbeddings,
+    LabelMetaData,
+    MetaData,
+)
+from core.utils.utils_cache import LRUCache
+from core.utils.utils_redis import bump_redis_version, get_redis_version
+
+# Using a prebuilt model
+# How this model was built: https://github.com/dsteedRTI/csv-to-embeddings-model
+# Sbert Model can be found here: https://www.sbert.net/docs/pretrained_models.html
+# Sbert Model Card: https://huggingface.co/sentence-transformers/multi-qa-mpnet-base-dot-v1
+EMBEDDINGS_MODEL_PATH = "core/smart_embeddings_model"
+
+# redis list the embeddings worker reads encode requests from
+EMBEDDINGS_REQUEST_QUEUE = "embeddings:requests"
+# number of requests waiting for the worker before callers stop sending more
+EMBEDDINGS_MAX_QUEUED_REQUESTS = 1000
+# seconds an unread reply is kept in redis
+EMBEDDINGS_REPLY_TIMEOUT = 60
+# number of data texts encoded and saved at once
+DATA_EMBEDDINGS_CHUNK_SIZE = 1000
+# number of labels suggested for a datum, and seconds the suggestions are cached
+NUM_LABEL_SUGGESTIONS = 5
+LABEL_SUGGESTIONS_TIMEOUT = 24 * 60 * 60
+# number of label indexes each process keeps in memory
+LABEL_INDEX_CACHE_SIZE = 32
+# seconds the label embeddings of a category are kept in redis
+LABEL_EMBEDDINGS_CACHE_TIMEOUT = 24 * 60 * 60
+# redis hash counting the lookups and misses of the label embeddings cache
+LABEL_EMBEDDINGS_CACHE_STATS = "label_embeddings:stats"
+
+LabelIndex = namedtuple("LabelIndex", ["num_labels", "label_ids", "matrix"])
+
+_label_index_cache = LRUCache(LABEL_INDEX_CACHE_SIZE)
+
+_embeddings_model = None
+_embeddings_model_lock = threading.Lock()
+
+
+def get_embeddings_model():
+    """Return the embeddings model of this process, loading it on first use.
+
+    The model is large, so processes which never compute an embedding (most
+    management commands, migrations, workers of other queues) never load it, and
+    the ones that do share a single copy.
+
+    Returns:
+        the SentenceTransformer model
+    """
+    global _embeddings_model
+    if _embeddings_model is None:
+        with _embeddings_model_lock:
+            if _embeddings_model is None:
+                from sentence_transformers import SentenceTransformer
+
+                _embeddings_model = SentenceTransformer(EMBEDDINGS_MODEL_PATH)
+    return _embeddings_model
+
+
+def encode(texts, service=True):
+    """Compute the embeddings of a string or a list of strings.
+
+    If settings.EMBEDDINGS_SERVICE is on, small interactive requests go to the
+    embeddings worker (see serve_embeddings) so they are batched with those of
+    other processes.  If the worker does not answer in time the embeddings are
+    computed here instead.  Requests of more than settings.EMBEDDINGS_BATCH_SIZE
+    texts, and callers passing service=False, always encode here, so bulk work
+    never holds up the worker.
+
+    Args:
+        texts: string or list of strings
+        service: False to never use the embeddings worker
+    Returns:
+        numpy array with the embedding, or one embedding per string
+    """
+    if not service or not settings.EMBEDDINGS_SERVICE:
+        return get_embeddings_model().encode(texts)
+
+    single = isinstance(texts, str)
+    text_list = [texts] if single else list(texts)
+    if len(text_list) == 0 or len(text_list) > settings.EMBEDDINGS_BATCH_SIZE:
+        return get_embeddings_model().encode(texts)
+
+    embeddings = request_embeddings(text_list)
+    if embeddings is None:
+        return get_embeddings_model().encode(texts)
+    return embeddings[0] if single else embeddings
+
+
+def redis_serialize_embeddings_reply(request_id):
+    """Serialize the key the worker pushes the reply to a request to.
+
+    The format is 'embeddings:reply:<request id>'
+    """
+    return "embeddings:reply:" + request_id
+
+
+def request_embeddings(text_list):
+    """Send texts to the embeddings worker and wait for their embeddings.
+
+    The request carries the time its caller stops waiting, so the worker can drop
+    it once nobody is left to read the reply.  The queue is capped at
+    EMBEDDINGS_MAX_QUEUED_REQUESTS, a request beyond that is dropped at once as the
+    worker is not keeping up, and the queue expires when nothing has been sent for
+    longer than any caller waits.
+
+    Args:
+        text_list: list of strings
+    Returns:
+        2D float32 array with one embedding per string, or None on timeout or when
+        the queue is full
+    """
+    request_id = uuid.uuid4().hex
+    request = {
+        "id": request_id,
+        "texts": text_list,
+        "deadline": time.time() + settings.EMBEDDINGS_TIMEOUT,
+    }
+    pipeline = settings.REDIS.pipeline()
+    pipeline.rpush(EMBEDDINGS_REQUEST_QUEUE, json.dumps(request))
+    pipeline.ltrim(EMBEDDINGS_REQUEST_QUEUE, 0, EMBEDDINGS_MAX_QUEUED_REQUESTS - 1)
+    pipeline.expire(EMBEDDINGS_REQUEST_QUEUE, settings.EMBEDDINGS_TIMEOUT)
+    queued = pipeline.execute()[0]
+    if queued > EMBEDDINGS_MAX_QUEUED_REQUESTS:
+        return None
+    reply = settings.REDIS.blpop(
+        redis_serialize_embeddings_reply(request_id), settings.EMBEDDINGS_TIMEOUT
+    )
+    if reply is None:
+        return None
+    return np.frombuffer(reply[1], dtype=np.float32).reshape(len(text_list), -1)
+
+
+def process_embedding_requests(block_timeout=1):
+    """Encode one micro-batch of requests from the request queue.
+
+    Waits up to block_timeout seconds for a first request, then keeps collecting
+    requests until settings.EMBEDDINGS_BATCH_SIZE texts are waiting or
+    settings.EMBEDDINGS_MAX_WAIT_MS has passed, and encodes them all in one call.
+    Requests past their deadline are dropped, their callers have already encoded
+    the texts themselves.
+
+    Args:
+        block_timeout: seconds to wait for the first request
+    Returns:
+        the number of requests answered
+    """
+    first = settings.REDIS.blpop(EMBEDDINGS_REQUEST_QUEUE, block_timeout)
+    if first is None:
+        return 0
+
+    requests = []
+    num_texts = 0
+    request = first[1]
+    deadline = time.monotonic() + settings.EMBEDDINGS_MAX_WAIT_MS / 1000
+    while True:
+        if request is not None:
+            request = json.loads(request)
+            if request["deadline"] > time.time():
+                requests.append(request)
+                num_texts += len(request["texts"])
+        if num_texts >= settings.EMBEDDINGS_BATCH_SIZE or time.monotonic() >= deadline:
+            break
+        request = settings.REDIS.lpop(EMBEDDINGS_REQUEST_QUEUE)
+        if request is None:
+            time.sleep(0.001)
+
+    if len(requests) == 0:
+        return 0
+
+    embeddings = get_embeddings_model().encode(
+        [text for request in requests for text in request["texts"]]
+    )
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+
+    pipeline = settings.REDIS.pipeline(transaction=False)
+    start = 0
+    for request in requests:
+        end = start + len(request["texts"])
+        key = redis_serialize_embeddings_reply(request["id"])
+        pipeline.rpush(key, embeddings[start:end].tobytes())
+        pipeline.expire(key, EMBEDDINGS_REPLY_TIMEOUT)
+        start = end
+    pipeline.execute()
+
+    return len(requests)
+
+
+def serve_embeddings():
+    """Run the embeddings worker, answering encode requests until stopped."""
+    get_embeddings_model()
+    while True:
+        process_embedding_requests()
+
+
+def create_data_embeddings(project_pk, chunk_size=DATA_EMBEDDINGS_CHUNK_SIZE):
+    """Compute and save the embeddings of the project data which has none yet.
+
+    Projects with too few labels for suggestions are skipped.
+
+    Args:
+        project_pk: primary key of the project
+        chunk_size: number of texts encoded at once
+    Returns:
+        the number of embeddings created
+    """
+    if Label.objects.filter(project_id=project_pk).count() <= NUM_LABEL_SUGGESTIONS:
+        return 0
+
+    num_created = 0
+    last_pk = 0
+    while True:
+        rows = list(
+            Data.objects.filter(
+                project_id=project_pk, pk__gt=last_pk, dataEmbedding__isnull=True
+            )
+            .order_by("pk")
+            .values_list("pk", "text")[:chunk_size]
+        )
+        if len(rows) == 0:
+            break
+        data_pks, texts = zip(*rows)
+        # this runs on the embeddings queue workers, the embeddings worker is for
+        # interactive requests
+        embeddings = np.asarray(
+            get_embeddings_model().encode(list(texts)), dtype=np.float32
+        )
+        DataEmbeddings.objects.bulk_create(
+            [
+                DataEmbeddings(data_id=data_pk, embedding=embedding.tobytes())
+                for data_pk, embedding in zip(data_pks, embeddings)
+            ],
+            ignore_conflicts=True,
+        )
+        num_created += len(rows)
+        last_pk = data_pks[-1]
+
+    return num_created
+
+
+def get_data_embedding(datum):
+    """Return the embedding of a datum, computing and saving it if it is missing.
+
+    Args:
+        datum: Data object
+    Returns:
+        1D float32 numpy array
+    """
+    stored = DataEmbeddings.objects.filter(data=datum).first()
+    if stored is not None:
+        return np.frombuffer(stored.embedding, dtype=np.float32)
+
+    embedding = np.asarray(encode(datum.text), dtype=np.float32)
+    DataEmbeddings.objects.bulk_create(
+        [DataEmbeddings(data=datum, embedding=embedding.tobytes())],
+        ignore_conflicts=True,
+    )
+    return embedding
+
+
+def get_datum_category(project, datum):
+    """Return the category of a datum, if the project has categories.
+
+    Args:
+        project: Project object
+        datum: Data object
+    Returns:
+        the category value, or None if the datum has no valid category
+    """
+    if not hasattr(project, "category"):
+        return None
+
+    data_metadata_obj = MetaData.objects.filter(
+        data=datum, metadata_field=project.category.data_metadata_field
+    ).first()
+    if (
+        data_metadata_obj is not None
+        and data_metadata_obj.value is not None
+        and data_metadata_obj.value.strip() != ""
+        and data_metadata_obj.value
+        in project.category.label_metadata_field.get_unique_options()
+    ):
+        return data_metadata_obj.value
+    return None
+
+
+def get_category_labels(project, category=None):
+    """Return the labels of a project which belong to a category.
+
+    Args:
+        project: Project object
+        category: the category value, or None for all labels
+    Returns:
+        Label queryset
+    """
+    project_labels = Label.objects.filter(project=project)
+    if category is None:
+        return project_labels
+
+    label_metadata_obj = LabelMetaData.objects.filter(
+        label_metadata_field=project.category.label_metadata_field,
+        value=category,
+    )
+    return project_labels.filter(
+        pk__in=label_metadata_obj.values_list("label__pk", flat=True)
+    )
+
+
+def build_label_index(project, category, version):
+    """Build the label index of a project category.
+
+    The index holds the embeddings as the rows of one contiguous float32 matrix,
+    normalized so the cosine similarities to a vector are a single matrix-vector
+    product.  It is read from the label embeddings cache, and built from
+    LabelEmbeddings on a miss.
+
+    Args:
+        project: Project object
+        category: the category value, or None for all labels
+        version: the label embeddings version of the project
+    Returns:
+        LabelIndex with the number of labels in the category, the label pks with
+        an embedding and their normalized embedding matrix
+    """
+    index = get_cached_label_embeddings(project.pk, category, version)
+    if index is not None:
+        return index
+
+    labels = get_category_labels(project, category)
+    label_embeddings = list(
+        LabelEmbeddings.objects.filter(label__in=labels).values_list(
+            "label_id", "embedding"
+        )
+    )
+    if len(label_embeddings) == 0:
+        index = LabelIndex(labels.count(), np.empty(0, dtype=np.int64), None)
+    else:
+        label_ids, vectors = zip(*label_embeddings)
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        matrix /= np.fmax(
+            np.linalg.norm(matrix, axis=1, keepdims=True), np.finfo(np.float32).tiny
+        )
+        index = LabelIndex(
+            labels.count(), np.asarray(label_ids, dtype=np.int64), matrix
+        )
+
+    cache_label_embeddings(project.pk, category, version, index)
+    return index
+
+
+def redis_serialize_label_embeddings(project_pk, category, version):
+    """Serialize the key of the label embeddings of a project category.
+
+    The format is 'label_embeddings:<project pk>:<version>:<category hash>', the
+    category is hashed as it may hold any characters.
+    """
+    if category is None:
+        category_hash = "all"
+    else:
+        category_hash = hashlib.md5(category.encode()).hexdigest()
+    return "label_embeddings:{}:{}:{}".format(project_pk, version, category_hash)
+
+
+def cache_label_embeddings(project_pk, category, version, index):
+    """Store the label index of a project category in redis.
+
+    The label pks and the embeddings are stored as raw int64 and float32 bytes in
+    a redis hash, so every process building the same index reads one copy.
+
+    Args:
+        project_pk: primary key of the project
+        category: the category value, or None for all labels
+        version: the label embeddings version of the project
+        index: LabelIndex
+    """
+    value = {
+        "num_labels": index.num_labels,
+        "label_ids": index.label_ids.astype(np.int64).tobytes(),
+    }
+    if index.matrix is not None:
+        value["embeddings"] = index.matrix.tobytes()
+        value["dimension"] = index.matrix.shape[1]
+
+    key = redis_serialize_label_embeddings(project_pk, category, version)
+    pipeline = settings.REDIS.pipeline()
+    pipeline.hset(key, mapping=value)
+    pipeline.expire(key, LABEL_EMBEDDINGS_CACHE_TIMEOUT)
+    pipeline.execute()
+
+
+def get_cached_label_embeddings(project_pk, category, version):
+    """Read the label index of a project category from redis.
+
+    Every lookup is counted in the same round trip as the read, and misses are
+    counted separately, see get_label_embeddings_cache_stats.
+
+    Args:
+        project_pk: primary key of the project
+        category: the category value, or None for all labels
+        version: the label embeddings version of the project
+    Returns:
+        LabelIndex, or None on a miss
+    """
+    pipeline = settings.REDIS.pipeline(transaction=False)
+    pipeline.hgetall(redis_serialize_label_embeddings(project_pk, category, version))
+    pipeline.hincrby(LABEL_EMBEDDINGS_CACHE_STATS, "lookups")
+    value = pipeline.execute()[0]
+    if len(value) == 0:
+        settings.REDIS.hincrby(LABEL_EMBEDDINGS_CACHE_STATS, "misses")
+        return None
+
+    label_ids = np.frombuffer(value[b"label_ids"], dtype=np.int64)
+    matrix = None
+    if b"embeddings" in value:
+        matrix = np.frombuffer(value[b"embeddings"], dtype=np.float32).reshape(
+            -1, int(value[b"dimension"])
+        )
+    return LabelIndex(int(value[b"num_labels"]), label_ids, matrix)
+
+
+def get_label_embeddings_cache_stats():
+    """Return the number of hits and misses of the label embeddings cache.
+
+    Returns:
+        dict with the hits and misses counts
+    """
+    stats = settings.REDIS.hgetall(LABEL_EMBEDDINGS_CACHE_STATS)
+    lookups = int(stats.get(b"lookups", 0))
+    misses = int(stats.get(b"misses", 0))
+    return {"hits": lookups - misses, "misses": misses}
+
+
+def get_label_index(project, category=None):
+    """Return the label index of a project category through the process-level LRU
+    cache.
+
+    Entries are checked against the label embeddings version of the project, so
+    an index is rebuilt once the label embeddings change.
+
+    Args:
+        project: Project object
+        category: the category value, or None for all labels
+    Returns:
+        LabelIndex
+    """
+    key = (project.pk, category)
+    version = get_label_embeddings_version(project.pk)
+    index = _label_index_cache.get(key, version)
+    if index is None:
+        index = build_label_index(project, category, version)
+        _label_index_cache.set(key, version, index)
+    return index
+
+
+def search_label_index(index, embedding, k=NUM_LABEL_SUGGESTIONS):
+    """Find the labels of an index most similar to an embedding.
+
+    Args:
+        index: LabelIndex
+        embedding: 1D array
+        k: number of labels to return
+    Returns:
+        list of up to k label primary keys, best first
+    """
+    if index.matrix is None:
+        return []
+
+    scores = index.matrix @ np.asarray(embedding, dtype=np.float32)
+    if len(scores) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    best = top[np.argsort(-scores[top], kind="stable")]
+    return index.label_ids[best].tolist()
+
+
+def compute_label_suggestions(project, datum):
+    """Rank the labels of a datum by the cosine similarity of their description
+    embeddings to the embedding of the datum text.
+
+    Args:
+        project: Project object
+        datum: Data object
+    Returns:
+        list of up to NUM_LABEL_SUGGESTIONS label primary keys, best first
+    """
+    category = get_datum_category(project, datum)
+    index = get_label_index(project, category)
+    if index.num_labels <= NUM_LABEL_SUGGESTIONS:
+        return list(get_category_labels(project, category).values_list("pk", flat=True))
+    return search_label_index(index, get_data_embedding(datum))
+
+
+def redis_serialize_label_embeddings_version(project_pk):
+    """Serialize the key holding the version of the label embeddings of a project.
+
+    The format is 'label_embeddings:<project pk>:version'
+    """
+    return "label_embeddings:" + str(project_pk) + ":version"
+
+
+def get_label_embeddings_version(project_pk):
+    """Return the version of the label embeddings of a project.
+
+    The version lives in redis so all processes see the same one, and a new one
+    is made up if it is missing.
+
+    Args:
+        project_pk: primary key of the project
+    Returns:
+        version string
+    """
+    return get_redis_version(redis_serialize_label_embeddings_version(project_pk))
+
+
+def redis_serialize_label_suggestions(project_pk, version, datum_pk):
+    """Serialize the key of the label suggestions of a datum.
+
+    The format is 'suggestions:<project pk>:<version>:<datum pk>'
+    """
+    return "suggestions:{}:{}:{}".format(project_pk, version, datum_pk)
+
+
+def get_label_suggestions(project, datum):
+    """Return the suggested labels of a datum, computing them on a cache miss.
+
+    The suggestions are cached in redis, so they are shared by every process.
+
+    Args:
+        project: Project object
+        datum: Data object
+    Returns:
+        list of label primary keys, best first
+    """
+    version = get_label_embeddings_version(project.pk)
+    key = redis_serialize_label_suggestions(project.pk, version, datum.pk)
+    suggestions = settings.REDIS.get(key)
+    if suggestions is not None:
+        return json.loads(suggestions)
+
+    suggestions = compute_label_suggestions(project, datum)
+    settings.REDIS.set(key, json.dumps(suggestions), ex=LABEL_SUGGESTIONS_TIMEOUT)
+    return suggestions
+
+
+def invalidate_label_embeddings(project_pk):
+    """Drop every cached copy of the label embeddings of a project.
+
+    This makes a new label embeddings version, which drops the cached label
+    embeddings, label indexes and label suggestions of the project in every
+    process, and then frees the label indexes of this process right away.
+
+    Args:
+        project_pk: primary key of the project
+    """
+    bump_redis_version(redis_serialize_label_embeddings_version(project_pk))
+    _label_index_cache.discard(lambda key: key[0] == project_pk)
@@ -0,0 +1,195 @@
+import re
+from bisect import bisect_left
+
+from core.models import Label
+from core.serializers import LabelSerializer
+from core.utils.utils_cache import LRUCache
+from core.utils.utils_redis import bump_redis_version, get_redis_version
+
+# number of token suffixes, summed over the label search indexes, each process
+# keeps in memory
+LABEL_SEARCH_CACHE_SIZE = 1000000
+
+_label_search_cache = LRUCache(LABEL_SEARCH_CACHE_SIZE, weigh=lambda index: index.size)
+
+
+def tokenize(text):
+    """Split a text into lowercase word tokens.
+
+    Args:
+        text: string
+    Returns:
+        list of tokens
+    """
+    if text is None or str(text) == "nan":
+        return []
+    return re.findall(r"\w+", str(text).lower())
+
+
+class LabelSearchIndex:
+    """In-memory search structure over the labels of a project.
+
+    Every suffix of every token of the label names, descriptions and metadata
+    values is kept in a sorted vocabulary, with an inverted index from each suffix
+    to the labels it appears in.  A query token is looked up as a prefix of the
+    vocabulary, so it matches anywhere inside a word, and a label matches when all
+    the query tokens do.  Every label the substring search on the database finds is
+    also found here.  The size of the index is the number of suffixes it holds
+    for all the labels.
+
+    Args:
+        labels: Label objects of the project, with their labelmetadata prefetched
+        category_field_id: pk of the label metadata field of the project category,
+            or None if the project has no category
+    """
+
+    def __init__(self, labels, category_field_id=None):
+        self.labels = [dict(label) for label in LabelSerializer(labels, many=True).data]
+        self.names = []
+        self.categories = []
+        self.name_tokens = []
+        self.label_tokens = []
+        self.postings = {}
+        self.size = 0
+
+        for position, label in enumerate(labels):
+            metadata = list(label.labelmetadata.all())
+            name_tokens = tokenize(label.name)
+            label_tokens = name_tokens + tokenize(label.description)
+            for m in metadata:
+                label_tokens += tokenize(m.value)
+
+            self.names.append(label.name.lower())
+            self.categories.append(
+                next(
+                    (
+                        m.value
+                        for m in metadata
+                        if m.label_metadata_field_id == category_field_id
+                    ),
+                    None,
+                )
+            )
+            self.name_tokens.append(name_tokens)
+            self.label_tokens.append(label_tokens)
+            for token in label_tokens:
+                for start in range(len(token)):
+                    self.postings.setdefault(token[start:], set()).add(position)
+                self.size += len(token)
+
+        self.vocabulary = sorted(self.postings)
+
+    def lookup(self, query_token):
+        """Return the positions of the labels with a word containing a token."""
+        positions = set()
+        i = bisect_left(self.vocabulary, query_token)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(query_token):
+            positions |= self.postings[self.vocabulary[i]]
+            i += 1
+        return positions
+
+    def rank(self, position, query, query_tokens):
+        """Sort key of a matching label, lower is better.
+
+        Labels whose name starts with the query come first, then the ones where
+        every query token starts a word of the name, then the ones where every
+        query token starts any word, then the rest, each in pk order.
+        """
+        if self.names[position].startswith(query):
+            tier = 0
+        elif all(
+            any(token.startswith(q) for token in self.name_tokens[position])
+            for q in query_tokens
+        ):
+            tier = 1
+        elif all(
+            any(token.startswith(q) for token in self.label_tokens[position])
+            for q in query_tokens
+        ):
+            tier = 2
+        else:
+            tier = 3
+        return (tier, position)
+
+    def search(self, text, category=None):
+        """Find the labels matching a search string.
+
+        Args:
+            text: the search string, empty for all labels
+            category: only return labels of this category value, or None for all
+        Returns:
+            list of serialized labels, best matches first
+        """
+        query = text.strip().lower()
+        query_tokens = tokenize(query)
+
+        positions = set(range(len(self.labels)))
+        for query_token in query_tokens:
+            positions &= self.lookup(query_token)
+            if len(positions) == 0:
+                return []
+        if category is not None:
+            positions = {p for p in positions if self.categories[p] == category}
+
+        return [
+            self.labels[p]
+            for p in sorted(positions, key=lambda p: self.rank(p, query, query_tokens))
+        ]
+
+
+def build_label_search_index(project):
+    """Build the label search index of a project with a single round of queries.
+
+    Args:
+        project: Project object
+    Returns:
+        LabelSearchIndex
+    """
+    labels = list(
+        Label.objects.filter(project=project).prefetch_related(
+            "labelmetadata__label_metadata_field"
+        )
+    )
+    category_field_id = None
+    if hasattr(project, "category"):
+        category_field_id = project.category.label_metadata_field_id
+    return LabelSearchIndex(labels, category_field_id)
+
+
+def redis_serialize_label_search_version(project_pk):
+    """Serialize the key holding the version of the labels of a project.
+
+    The format is 'labels:<project pk>:version'
+    """
+    return "labels:" + str(project_pk) + ":version"
+
+
+def get_label_search_index(project):
+    """Return the label search index of a project through the process-level LRU
+    cache.
+
+    Entries are checked against the labels version of the project in redis, so an
+    index is rebuilt in every process once the labels change.  The cache is bounded
+    by the total size of the indexes, see LABEL_SEARCH_CACHE_SIZE.
+
+    Args:
+        project: Project object
+    Returns:
+        LabelSearchIndex
+    """
+    version = get_redis_version(redis_serialize_label_search_version(project.pk))
+    index = _label_search_cache.get(project.pk, version)
+    if index is None:
+        index = build_label_search_index(project)
+        _label_search_cache.set(project.pk, version, index)
+    return index
+
+
+def invalidate_label_search_index(project_pk):
+    """Drop the label search index of a project in every process.
+
+    Args:
+        project_pk: primary key of the project
+    """
+    bump_redis_version(redis_serialize_label_search_version(project_pk))
+    _label_search_cache.discard(lambda key: key == project_pk)
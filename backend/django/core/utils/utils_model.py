@@ -1,19 +1,34 @@
-import math
+import json
 import os
 import pickle
+import shutil
+import time
+from io import StringIO
 
 import joblib
 import numpy as np
 import pandas as pd
+import sklearn
 import statsmodels.stats.inter_rater as raters
+from celery.exceptions import Ignore
+from celery.result import AsyncResult
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from joblib import Parallel, delayed
 from scipy import sparse
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import (
+    HashingVectorizer,
+    TfidfTransformer,
+    TfidfVectorizer,
+)
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
-from sklearn.model_selection import cross_val_predict
+from sklearn.model_selection import cross_val_predict, train_test_split
 from sklearn.naive_bayes import GaussianNB
+from sklearn.pipeline import make_pipeline
 from sklearn.svm import SVC
 
 from core import tasks
@@ -25,10 +40,34 @@ from core.models import (
     IRRLog,
     Label,
     Model,
+    Project,
     RecycleBin,
+    TrainingSet,
 )
+from core.utils.utils_cache import LRUCache
 from core.utils.utils_queue import fill_queue, handle_empty_queue
 
+# number of texts used to estimate the out-of-vocabulary fraction of a vectorizer
+OOV_SAMPLE_SIZE = 10000
+# number of texts transformed per chunk when vectorizing
+TRANSFORM_CHUNK_SIZE = 50000
+# size of the fixed feature space used by the hashing vectorizers
+HASHING_N_FEATURES = 2**18
+# number of unlabeled rows predicted and saved per chunk
+PREDICT_CHUNK_SIZE = 20000
+# number of rows deleted per query when pruning old predictions
+PRUNE_BATCH_SIZE = 50000
+# seconds before a label counter is dropped and recounted from the database
+LABELED_COUNT_TIMEOUT = 60 * 60
+# seconds a training lock is held, a crashed task frees its training set after this
+TRAINING_LOCK_TIMEOUT = 6 * 60 * 60
+# the stages of send_model_task, in order, as published by report_training_progress
+TRAINING_STAGES = ["load features", "fit", "persist", "predict"]
+# number of loaded classifiers and vectorizers each process keeps in memory
+ARTIFACT_CACHE_SIZE = 16
+
+_artifact_cache = LRUCache(ARTIFACT_CACHE_SIZE)
+
 
 def cohens_kappa(project):
     """
@@ -152,15 +191,15 @@ def least_confident(probs):
         p is probability of highest probability class
 
     Args:
-        probs: List of predicted probabilites
+        probs: Array of predicted probabilites, or a 2D array with one row of
+            probabilities per datum
     Returns:
-        x
+        x, or an array of x for each row
     """
     if not isinstance(probs, np.ndarray):
         raise ValueError("Probs should be a numpy array")
 
-    max_prob = max(probs)
-    return 1 - max_prob
+    return 1 - probs.max(axis=-1)
 
 
 def margin_sampling(probs):
@@ -168,18 +207,19 @@ def margin_sampling(probs):
 
         x = p1 - p2
         p1 is probabiiity of highest probability class
-        p2 is probability of lowest probability class
+        p2 is probability of second highest probability class
     Args:
-        probs: List of predicted probabilities
+        probs: Array of predicted probabilities, or a 2D array with one row of
+            probabilities per datum
     Returns:
-        x
+        x, or an array of x for each row
     """
     if not isinstance(probs, np.ndarray):
         raise ValueError("Probs should be a numpy array")
 
-    # https://stackoverflow.com/questions/26984414/efficiently-sorting-a-numpy-array-in-descending-order#answer-26984520
-    probs[::-1].sort()
-    return probs[0] - probs[1]
+    # partition only needs to find the top two of each row, not sort it
+    top_two = np.partition(probs, -2, axis=-1)
+    return top_two[..., -1] - top_two[..., -2]
 
 
 def entropy(probs):
@@ -187,20 +227,17 @@ def entropy(probs):
         x = -sum(p * log(p))
         the sum is sumation across p's
     Args:
-        probs: List of predicted probabilities
+        probs: Array of predicted probabilities, or a 2D array with one row of
+            probabilities per datum
     Returns:
-        x
+        x, or an array of x for each row
     """
     if not isinstance(probs, np.ndarray):
         raise ValueError("Probs should be a numpy array")
 
-    non_zero_probs = (p for p in probs if p > 0)
-
-    total = 0
-    for p in non_zero_probs:
-        total += p * math.log10(p)
-
-    return -total
+    # zero probabilities add nothing to the sum, log(1) = 0 keeps them out
+    non_zero_probs = np.where(probs > 0, probs, 1)
+    return -np.sum(probs * np.log10(non_zero_probs), axis=-1)
 
 
 def check_and_trigger_model(datum, profile=None):
@@ -216,11 +253,19 @@ def check_and_trigger_model(datum, profile=None):
     project = datum.project
     current_training_set = project.get_current_training_set()
     batch_size = project.batch_size
-    labeled_data = DataLabel.objects.filter(
-        data__project=project, training_set=current_training_set, data__irr_ind=False
-    )
-    labeled_data_count = labeled_data.count()
-    labels_count = labeled_data.distinct("label").count()
+
+    # the redis counter is a cheap upper bound on the labels in this training set,
+    # the database is only counted once it says the batch may be full
+    labeled_data_count = incr_labeled_count(current_training_set)
+    if labeled_data_count >= batch_size:
+        labeled_data = DataLabel.objects.filter(
+            data__project=project,
+            training_set=current_training_set,
+            data__irr_ind=False,
+        )
+        labeled_data_count = labeled_data.count()
+        labels_count = labeled_data.distinct("label").count()
+        set_labeled_count(current_training_set, labeled_data_count)
 
     if current_training_set.celery_task_id != "":
         return_str = "task already running"
@@ -241,11 +286,17 @@ def check_and_trigger_model(datum, profile=None):
                 irr_percent=project.percentage_irr,
             )
             return_str = "random"
-        else:
-            task_num = tasks.send_model_task.delay(project.pk)
+        elif acquire_training_lock(current_training_set):
+            # wait a moment so labels from other coders crossing the batch size at
+            # the same time are trained on in this round
+            task_num = tasks.send_model_task.apply_async(
+                args=[project.pk], countdown=settings.MODEL_TRIGGER_DELAY
+            )
             current_training_set.celery_task_id = task_num
             current_training_set.save()
             return_str = "model running"
+        else:
+            return_str = "task already running"
     elif profile:
         # Model is not running, check if user needs more data
         handle_empty_queue(profile, project)
@@ -257,14 +308,224 @@ def check_and_trigger_model(datum, profile=None):
     return return_str
 
 
-def train_and_save_model(project):
+def redis_serialize_training_set(training_set, name):
+    """Serialize a key for the model training state of a training set.
+
+    The format is 'training:<project pk>:<set number>:<name>'
+    """
+    return "training:{}:{}:{}".format(
+        training_set.project_id, training_set.set_number, name
+    )
+
+
+def incr_labeled_count(training_set):
+    """Count one more label towards a training set.
+
+    A new counter starts from the number of labels in the database.  It runs ahead
+    of the database for skipped and IRR data, and is corrected with
+    set_labeled_count once it reaches the batch size.  Labels written without
+    passing through here, such as labeled uploads, skew labels and resolved IRR
+    labels, drop the counter with reset_labeled_count so it is recounted.
+
+    Args:
+        training_set: TrainingSet object
+    Returns:
+        count: the number of labels counted so far
+    """
+    key = redis_serialize_training_set(training_set, "labeled")
+    count = settings.REDIS.incr(key)
+    if count == 1:
+        count = DataLabel.objects.filter(
+            data__project_id=training_set.project_id,
+            training_set=training_set,
+            data__irr_ind=False,
+        ).count()
+        set_labeled_count(training_set, count)
+    return count
+
+
+def set_labeled_count(training_set, count):
+    """Reset the label counter of a training set to the count from the database.
+
+    Args:
+        training_set: TrainingSet object
+        count: the number of labels in the training set
+    """
+    key = redis_serialize_training_set(training_set, "labeled")
+    settings.REDIS.set(key, count, ex=LABELED_COUNT_TIMEOUT)
+
+
+def reset_labeled_count(training_set):
+    """Drop the label counter of a training set, the next label recounts it.
+
+    Args:
+        training_set: TrainingSet object
+    """
+    settings.REDIS.delete(redis_serialize_training_set(training_set, "labeled"))
+
+
+def acquire_training_lock(training_set):
+    """Atomically claim the right to train the model for a training set.
+
+    Only the first caller gets the lock, so concurrent labels crossing the batch
+    size enqueue a single model task.
+
+    Args:
+        training_set: TrainingSet object
+    Returns:
+        True if the lock was acquired
+    """
+    key = redis_serialize_training_set(training_set, "lock")
+    return bool(settings.REDIS.set(key, 1, nx=True, ex=TRAINING_LOCK_TIMEOUT))
+
+
+def report_training_progress(task, training_set, stage, timings, done=None, total=None):
+    """Publish the stage a model task has reached to the result backend.
+
+    This is also where a superseded task stops: if supersede_model_task has
+    cancelled it, the task is marked REVOKED and ends at the start of the next stage.
+
+    Args:
+        task: the bound Celery task
+        training_set: TrainingSet object the task is training
+        stage: one of TRAINING_STAGES
+        timings: dictionary of seconds spent per stage, updated in place
+        done: number of items of the stage finished so far, if it is chunked
+        total: number of items in the stage, if it is chunked
+    """
+    task_id = task.request.id
+    if is_model_task_cancelled(training_set, task_id):
+        task.update_state(state="REVOKED", meta={"stage": stage, "timings": timings})
+        raise Ignore()
+
+    # the time of the previous stage runs until this one starts
+    now = time.monotonic()
+    if "_started" in timings:
+        previous_stage, started = timings["_started"]
+        timings[previous_stage] = timings.get(previous_stage, 0) + now - started
+    timings["_started"] = (stage, now)
+
+    if task_id is not None:
+        task.update_state(
+            state="PROGRESS",
+            meta={
+                "stage": stage,
+                "stages": TRAINING_STAGES,
+                "done": done,
+                "total": total,
+                "timings": {k: v for k, v in timings.items() if k != "_started"},
+            },
+        )
+
+
+def get_training_progress(project):
+    """Get the state of the model task of the current training set of a project.
+
+    Args:
+        project: Project object
+    Returns:
+        dictionary with the task id, its Celery state, and the progress published
+        by report_training_progress, empty if no task has been started
+    """
+    task_id = project.get_current_training_set().celery_task_id
+    if task_id == "":
+        return {}
+
+    result = AsyncResult(task_id)
+    progress = {"task_id": task_id, "state": result.state}
+    if isinstance(result.info, dict):
+        progress.update(result.info)
+    return progress
+
+
+def is_model_task_cancelled(training_set, task_id):
+    """Check if supersede_model_task has cancelled a model task.
+
+    Args:
+        training_set: TrainingSet object the task is training
+        task_id: the id of the task
+    Returns:
+        True if the task was cancelled
+    """
+    if task_id is None:
+        return False
+    cancelled = settings.REDIS.get(redis_serialize_training_set(training_set, "cancel"))
+    return cancelled is not None and cancelled.decode() == task_id
+
+
+def release_model_task(training_set, task_id):
+    """Forget a model task that failed, so check_and_trigger_model can start another.
+
+    Nothing is changed if another task has replaced it in the meantime.
+
+    Args:
+        training_set: TrainingSet object the task was training
+        task_id: the id of the task
+    """
+    with transaction.atomic():
+        released = TrainingSet.objects.filter(
+            pk=training_set.pk, celery_task_id=task_id
+        ).update(celery_task_id="")
+        if released:
+            settings.REDIS.delete(redis_serialize_training_set(training_set, "lock"))
+
+
+def supersede_model_task(project, restart=True):
+    """Cancel the model task of the current training set, and optionally start a new
+    one on the labels available now.
+
+    A task waiting in the queue is revoked.  A running task stops at its next stage,
+    see report_training_progress, and a task that has already trained takes the
+    training set row lock before starting the next training set, so it either sees
+    the cancel or is seen here as finished.  The new task goes through the checks of
+    check_and_trigger_model.
+
+    Args:
+        project: Project object
+        restart: start a new model task in place of the cancelled one
+    Returns:
+        task_id: the id of the new task, or None
+    """
+    with transaction.atomic():
+        training_set = TrainingSet.objects.select_for_update().get(
+            pk=project.get_current_training_set().pk
+        )
+        task_id = training_set.celery_task_id
+        if task_id == "" or project.get_current_training_set() != training_set:
+            # nothing is running, or the task finished before it could be cancelled
+            return None
+
+        AsyncResult(task_id).revoke()
+        settings.REDIS.set(
+            redis_serialize_training_set(training_set, "cancel"),
+            task_id,
+            ex=TRAINING_LOCK_TIMEOUT,
+        )
+        settings.REDIS.delete(redis_serialize_training_set(training_set, "lock"))
+        training_set.celery_task_id = ""
+        training_set.save()
+
+    datum = Data.objects.filter(project=project).first()
+    if not restart or datum is None:
+        return None
+    reset_labeled_count(training_set)
+    if check_and_trigger_model(datum) != "model running":
+        return None
+    training_set.refresh_from_db()
+    return training_set.celery_task_id
+
+
+def train_and_save_model(project, progress=None):
     """Given a project create a model, train it, and save the model pickle.
 
     Args:
         project: The project to start training
+        progress: optional callback taking the name of each stage as it starts
     Returns:
         model: A model object
     """
+    if progress is None:
+        progress = _no_progress
     if project.classifier == "logistic regression":
         clf = LogisticRegression(
             class_weight="balanced", solver="lbfgs", multi_class="multinomial"
@@ -274,40 +535,31 @@ def train_and_save_model(project):
     elif project.classifier == "random forest":
         clf = RandomForestClassifier()
     elif project.classifier == "gnb":
+        if project.vectorizer != "tfidf":
+            # the dense matrix of a hashing feature space does not fit in memory
+            raise ValueError(
+                "Gaussian Naive Bayes needs the tfidf vectorizer, project: "
+                + str(project.pk)
+            )
         clf = GaussianNB()
     else:
         raise ValueError(
             "There was no valid classifier for project: " + str(project.pk)
         )
-    tf_idf = load_tfidf_matrix(project.pk)
-
     current_training_set = project.get_current_training_set()
 
-    # In order to train need X (tf-idf vector) and Y (label) for every labeled datum
-    # Order both X and Y by upload_id_hash to ensure the tf-idf vector corresponds to the correct
-    # label
-
-    labeled_data = DataLabel.objects.filter(data__project=project)
-    unique_ids = list(
-        labeled_data.values_list("data__upload_id", flat=True).order_by(
-            "data__upload_id_hash"
-        )
-    )
-    labeled_values = list(
-        labeled_data.values_list("label", flat=True).order_by("data__upload_id_hash")
-    )
-
-    X = [tf_idf[id] for id in unique_ids]
-    Y = labeled_values
+    progress("load features")
+    X, Y = get_labeled_features(project)
+    if isinstance(clf, GaussianNB):
+        # GaussianNB does not accept sparse input
+        X = X.toarray()
+    previous_clf = load_warm_start_classifier(project, X, Y)
+    if previous_clf is not None:
+        clf = previous_clf
+    progress("fit")
     clf.fit(X, Y)
 
-    classes = [str(c) for c in clf.classes_]
-    keys = ("precision", "recall", "f1")
-    cv_predicts = cross_val_predict(clf, X, Y, cv=5)
-    cv_accuracy = accuracy_score(Y, cv_predicts)
-    metrics = precision_recall_fscore_support(Y, cv_predicts)
-    metric_map = map(lambda x: dict(zip(classes, x)), metrics[:3])
-    cv_metrics = dict(zip(keys, metric_map))
+    progress("persist")
 
     fpath = os.path.join(
         settings.MODEL_PICKLE_PATH,
@@ -320,31 +572,206 @@ def train_and_save_model(project):
 
     joblib.dump(clf, fpath)
 
+    # the metrics are filled in by evaluate_model, which is kept off the critical
+    # path so new predictions are not held up by cross validation
     model = Model.objects.create(
         pickle_path=fpath,
         project=project,
         training_set=current_training_set,
-        cv_accuracy=cv_accuracy,
-        cv_metrics=cv_metrics,
     )
 
     return model
 
 
-def predict_data(project, model):
+def _no_progress(stage, done=None, total=None):
+    pass
+
+
+def get_labeled_features(project, labeled_data=None):
+    """Get the tf-idf rows and labels of the labeled data of a project.
+
+    Args:
+        project: Project object
+        labeled_data: DataLabel queryset to use, defaults to all labels of the project
+    Returns:
+        X: CSR-format tf-idf rows
+        Y: list of label pks, aligned with the rows of X
+    """
+    if labeled_data is None:
+        labeled_data = DataLabel.objects.filter(data__project=project)
+    tf_idf = load_tfidf_matrix(project.pk)
+
+    # In order to train need X (tf-idf vector) and Y (label) for every labeled datum
+    # Order both X and Y by upload_id_hash to ensure the tf-idf vector corresponds to
+    # the correct label
+    labeled_rows = list(
+        labeled_data.values_list("data__upload_id", "label").order_by(
+            "data__upload_id_hash"
+        )
+    )
+    if len(labeled_rows) == 0:
+        return get_tfidf_rows(tf_idf, []), []
+    unique_ids, labeled_values = zip(*labeled_rows)
+
+    return get_tfidf_rows(tf_idf, unique_ids), list(labeled_values)
+
+
+def evaluate_model(model, strategy=None):
+    """Estimate the accuracy and per label metrics of a trained model and save them.
+
+    The strategies are:
+        kfold: cross validated predictions over all labeled data, the folds are
+            fit in settings.MODEL_EVALUATION_N_JOBS processes
+        holdout: a single fit on part of the labeled data, scored on the rest
+        rolling: the previous model scored on the data labeled since it was
+            trained, which needs no extra fits.  Falls back to kfold when there
+            is no previous model or nothing new to score.
+
+    Args:
+        model: Model object
+        strategy: one of "kfold", "holdout" or "rolling", defaults to
+            settings.MODEL_EVALUATION
+    Returns:
+        model: the Model object with cv_accuracy and cv_metrics set
+    """
+    if strategy is None:
+        strategy = settings.MODEL_EVALUATION
+
+    project = model.project
+    clf = load_model_classifier(model)
+
+    y_true = y_pred = None
+    if strategy == "rolling":
+        y_true, y_pred = rolling_predictions(model)
+        if y_true is None:
+            strategy = "kfold"
+
+    if strategy in ("kfold", "holdout"):
+        X, Y = get_labeled_features(project)
+        if isinstance(clf, GaussianNB):
+            X = X.toarray()
+        # clone only copies the parameters, so each fit starts from scratch
+        estimator = clone(clf)
+        if strategy == "kfold":
+            y_true = Y
+            y_pred = cross_val_predict(
+                estimator,
+                X,
+                Y,
+                cv=settings.MODEL_EVALUATION_FOLDS,
+                n_jobs=settings.MODEL_EVALUATION_N_JOBS,
+            )
+        else:
+            X_train, X_test, Y_train, y_true = train_test_split(
+                X,
+                Y,
+                test_size=settings.MODEL_EVALUATION_HOLDOUT,
+                random_state=0,
+            )
+            y_pred = estimator.fit(X_train, Y_train).predict(X_test)
+    elif strategy != "rolling":
+        raise ValueError("There was no valid evaluation strategy: " + str(strategy))
+
+    classes = [str(c) for c in clf.classes_]
+    keys = ("precision", "recall", "f1")
+    metrics = precision_recall_fscore_support(
+        y_true, y_pred, labels=clf.classes_, zero_division=0
+    )
+    metric_map = map(lambda x: dict(zip(classes, x)), metrics[:3])
+
+    model.cv_accuracy = accuracy_score(y_true, y_pred)
+    model.cv_metrics = dict(zip(keys, metric_map))
+    model.save(update_fields=["cv_accuracy", "cv_metrics"])
+
+    return model
+
+
+def rolling_predictions(model):
+    """Predict the data labeled since the previous model of a project was trained
+    with that previous model.
+
+    Args:
+        model: Model object
+    Returns:
+        y_true: list of labels, or None if there is nothing to score
+        y_pred: predictions of the previous model, or None
+    """
+    previous_model = (
+        Model.objects.filter(project=model.project, pk__lt=model.pk)
+        .order_by("-pk")
+        .first()
+    )
+    if previous_model is None or not os.path.isfile(previous_model.pickle_path):
+        return None, None
+
+    new_labels = DataLabel.objects.filter(
+        data__project=model.project,
+        training_set__set_number__gt=previous_model.training_set.set_number,
+    )
+    X, Y = get_labeled_features(model.project, new_labels)
+    previous_clf = load_model_classifier(previous_model)
+    if len(Y) == 0 or previous_clf.n_features_in_ != X.shape[1]:
+        return None, None
+    if isinstance(previous_clf, GaussianNB):
+        X = X.toarray()
+
+    return Y, previous_clf.predict(X)
+
+
+def load_warm_start_classifier(project, X, Y):
+    """Load the classifier of the previous round so it can be warm started.
+
+    Only logistic regression is warm started.  Its loss is convex, so starting from
+    the previous coefficients only changes how many iterations the fit takes, not
+    the model it converges to.  The previous classifier is only usable if it was
+    trained on the same labels and number of features.
+
+    Args:
+        project: Project object
+        X: tf-idf rows of the labeled data
+        Y: labels of the labeled data
+    Returns:
+        clf: the previous classifier with warm_start set, or None to train a new one
+    """
+    if not settings.MODEL_WARM_START or project.classifier != "logistic regression":
+        return None
+
+    previous_model = Model.objects.filter(project=project).order_by("-pk").first()
+    if previous_model is None or not os.path.isfile(previous_model.pickle_path):
+        return None
+
+    # load a private copy, the cached classifier must not be refit in place
+    clf = joblib.load(previous_model.pickle_path)
+    if (
+        not isinstance(clf, LogisticRegression)
+        or clf.n_features_in_ != X.shape[1]
+        or not np.array_equal(clf.classes_, np.unique(Y))
+    ):
+        return None
+
+    clf.set_params(warm_start=True)
+    return clf
+
+
+def predict_data(project, model, progress=None):
     """Given a project and its model, predict any unlabeled data and create.
 
         Prediction objects for each.  There will be #label * #unlabeled_data
         predictions.  This is because we are saving the probability of each label
-        for every data.
+        for every data.  If the project sets prediction_top_k, only that many of
+        the most probable labels are saved for each data.
 
     Args:
         project: Project object
         model: Model object
+        progress: optional callback taking the stage name and the number of data
+            predicted so far out of the total
     Returns:
-        predictions: List of DataPrediction objects
+        predictions: QuerySet of the DataPrediction objects
     """
-    clf = joblib.load(model.pickle_path)
+    if progress is None:
+        progress = _no_progress
+    clf = load_model_classifier(model)
     tf_idf = load_tfidf_matrix(project.pk)
 
     # In order to predict need X (tf-idf vector) for every unlabeled datum. Order
@@ -357,123 +784,872 @@ def predict_data(project, model):
         .exclude(pk__in=recycle_data)
         .order_by("upload_id_hash")
     )
-    unique_ids = list(
-        unlabeled_data.values_list("upload_id", flat=True).order_by("upload_id_hash")
+    data_rows = list(unlabeled_data.values_list("pk", "upload_id"))
+    if len(data_rows) == 0:
+        return DataPrediction.objects.none()
+    data_pks, unique_ids = zip(*data_rows)
+
+    # predict chunks of rows in parallel, saving each chunk as soon as it is ready
+    # so only a few chunks of X and the probabilities are in memory at once
+    chunks = [
+        slice(i, i + PREDICT_CHUNK_SIZE)
+        for i in range(0, len(unique_ids), PREDICT_CHUNK_SIZE)
+    ]
+    predicted_chunks = Parallel(
+        n_jobs=settings.PREDICT_N_JOBS, pre_dispatch="2*n_jobs", return_as="generator"
+    )(
+        delayed(predict_chunk)(clf, get_tfidf_rows(tf_idf, unique_ids[chunk]))
+        for chunk in chunks
     )
 
-    # get the list of all data sorted by identifier
-    X = [tf_idf[id] for id in unique_ids]
-    predictions = clf.predict_proba(X)
-
-    label_obj = [Label.objects.get(pk=label) for label in clf.classes_]
-
-    bulk_predictions = []
-    for datum, prediction in zip(unlabeled_data, predictions):
-        # each prediction is an array of probabilities.  Each index in that array
-        # corresponds to the label of the same index in clf.classes_
-        for p, label in zip(prediction, label_obj):
-            bulk_predictions.append(
-                DataPrediction(
-                    data=datum, model=model, label=label, predicted_probability=p
-                )
+    with transaction.atomic():
+        for chunk, predictions in zip(chunks, predicted_chunks):
+            progress("predict", chunk.start, len(data_pks))
+            create_predictions_from_array(
+                model,
+                data_pks[chunk],
+                clf.classes_,
+                predictions,
+                top_k=project.prediction_top_k,
             )
+            # Need to create uncertainty objects so fill_queue can sort by one of
+            # the metrics
+            create_uncertainty_from_array(model, data_pks[chunk], predictions)
 
-        # Need to crate uncertainty object so fill_queue can sort by one of the metrics
-        lc = least_confident(prediction)
-        ms = margin_sampling(prediction)
-        e = entropy(prediction)
+    return DataPrediction.objects.filter(model=model)
 
-        DataUncertainty.objects.create(
-            data=datum, model=model, least_confident=lc, margin_sampling=ms, entropy=e
-        )
 
-    prediction_objs = DataPrediction.objects.bulk_create(bulk_predictions)
+def predict_chunk(clf, X):
+    """Predict the label probabilities for a chunk of tf-idf rows.
 
-    return prediction_objs
+    Args:
+        clf: fitted classifier
+        X: CSR-format tf-idf rows
+    Returns:
+        2D array of probabilities, one column per class in clf.classes_
+    """
+    if isinstance(clf, GaussianNB):
+        # GaussianNB does not accept sparse input
+        X = X.toarray()
+    return clf.predict_proba(X)
+
+
+def prune_old_predictions(project, keep_models=None, batch_size=PRUNE_BATCH_SIZE):
+    """Delete the predictions and uncertainty scores of all but the most recent
+    models of a project.
+
+    Only the latest model is used to order the queue and show predictions, so the
+    rows of older rounds are dead weight.  They are deleted in batches to keep each
+    transaction and lock short.
+
+    Args:
+        project: Project object
+        keep_models: number of most recent models to keep the rows of, defaults to
+            settings.PREDICTION_RETENTION_MODELS
+        batch_size: number of rows deleted per query
+    Returns:
+        num_deleted: total number of rows deleted
+    """
+    if keep_models is None:
+        keep_models = settings.PREDICTION_RETENTION_MODELS
+
+    stale_models = list(
+        Model.objects.filter(project=project)
+        .order_by("-pk")
+        .values_list("pk", flat=True)[keep_models:]
+    )
+    if len(stale_models) == 0:
+        return 0
+
+    num_deleted = 0
+    for model_class in (DataPrediction, DataUncertainty):
+        stale_rows = model_class.objects.filter(model__in=stale_models)
+        while True:
+            batch = list(stale_rows.values_list("pk", flat=True)[:batch_size])
+            if len(batch) == 0:
+                break
+            num_deleted += model_class.objects.filter(pk__in=batch).delete()[0]
+
+    return num_deleted
+
+
+def create_predictions_from_array(model, data_pks, label_pks, predictions, top_k=None):
+    """Insert DataPrediction objects into the database using cursor.copy_from.
+
+    There is one row for every datum and label, since the probability of each label
+    is saved for every datum, unless top_k limits it to the most probable labels.
+
+    Args:
+        model: Model object that made the predictions
+        data_pks: list of Data pks, one per row of predictions
+        label_pks: list of Label pks, one per column of predictions
+        predictions: 2D array of predicted probabilities
+        top_k: number of labels to keep for each datum, or None to keep all
+    """
+    num_data, num_labels = predictions.shape
+    label_pks = np.asarray(label_pks)
+    if top_k is not None and top_k < num_labels:
+        top_labels = np.argpartition(-predictions, top_k - 1, axis=1)[:, :top_k]
+        predictions = np.take_along_axis(predictions, top_labels, axis=1)
+        label_ids = label_pks[top_labels].ravel()
+        num_labels = top_k
+    else:
+        label_ids = np.tile(label_pks, num_data)
+
+    df = pd.DataFrame(
+        {
+            "data_id": np.repeat(np.asarray(data_pks), num_labels),
+            "model_id": model.pk,
+            "label_id": label_ids,
+            "predicted_probability": predictions.ravel(),
+        }
+    )
+    copy_dataframe(df, DataPrediction)
+
+
+def create_uncertainty_from_array(model, data_pks, predictions):
+    """Insert DataUncertainty objects into the database using cursor.copy_from.
+
+    Args:
+        model: Model object that made the predictions
+        data_pks: list of Data pks, one per row of predictions
+        predictions: 2D array of predicted probabilities
+    """
+    df = pd.DataFrame(
+        {
+            "data_id": np.asarray(data_pks),
+            "model_id": model.pk,
+            "least_confident": least_confident(predictions),
+            "margin_sampling": margin_sampling(predictions),
+            "entropy": entropy(predictions),
+        }
+    )
+    copy_dataframe(df, DataUncertainty)
+
+
+def copy_dataframe(df, model_class):
+    """Insert the rows of a dataframe into the table of a model with
+    cursor.copy_from by creating an in-memory tsv representation of the rows.
+
+    Args:
+        df: DataFrame whose columns are named after the table columns
+        model_class: the Django model to insert into
+    """
+    stream = StringIO()
+    df.to_csv(stream, sep="\t", header=False, index=False)
+    stream.seek(0)
+
+    with connection.cursor() as c:
+        c.copy_from(
+            stream,
+            model_class._meta.db_table,
+            sep="\t",
+            null="",
+            columns=list(df.columns),
+        )
 
 
 def create_tfidf_matrix(project_pk, max_df=0.995, min_df=0.005):
     """Create a TF-IDF matrix. Make sure to order the data by upload_id_hash so that we
     can sync the data up again when training the model.
 
+    The matrix is kept in sparse CSR format, so its size scales with the number of
+    non-zero entries rather than rows * vocabulary. Projects using a hashing
+    vectorizer skip the vocabulary fit entirely.
+
     Args:
         project_pk: The pk of the project
     Returns:
-        tf_idf_matrix: CSR-format tf-idf matrix
+        tf_idf: dictionary with the CSR-format tf-idf matrix under "matrix", the row
+            index (see build_row_index) under "row_ids" and "row_offsets", the
+            largest Data pk included, the out-of-vocabulary token fraction and the
+            project vectorizer option
+        fitted_vectorizer: the fitted vectorizer
+    """
+    vectorizer_type = Project.objects.get(pk=project_pk).vectorizer
+
+    # pin the set of data being vectorized so later appends know where to start
+    max_data_pk = Data.objects.filter(project__pk=project_pk).aggregate(Max("pk"))[
+        "pk__max"
+    ]
+    project_data = Data.objects.filter(project__pk=project_pk, pk__lte=max_data_pk)
+
+    oov_fraction = 0.0
+    if vectorizer_type == "tfidf":
+        # fit_transform counts every text in a single pass over the stream, and
+        # the first texts are kept aside to measure the out-of-vocabulary fraction
+        id_list = []
+        oov_sample = []
+
+        def texts():
+            for ids, chunk in iter_text_chunks(project_data):
+                id_list.extend(ids)
+                oov_sample.extend(chunk[: OOV_SAMPLE_SIZE - len(oov_sample)])
+                yield from chunk
+
+        fitted_vectorizer = TfidfVectorizer(
+            max_df=max_df, min_df=min_df, stop_words="english"
+        )
+        tf_idf_matrix = sparse.csr_matrix(fitted_vectorizer.fit_transform(texts()))
+        oov_fraction = tfidf_oov_fraction(fitted_vectorizer, oov_sample)
+    elif vectorizer_type == "hashing":
+        fitted_vectorizer = HashingVectorizer(
+            n_features=HASHING_N_FEATURES, alternate_sign=False, stop_words="english"
+        )
+        id_list, tf_idf_matrix = transform_queryset(fitted_vectorizer, project_data)
+    elif vectorizer_type == "hashing tfidf":
+        # hash the raw counts, then only the IDF weights need a fit
+        hashing_vectorizer = HashingVectorizer(
+            n_features=HASHING_N_FEATURES,
+            alternate_sign=False,
+            stop_words="english",
+            norm=None,
+        )
+        id_list, counts = transform_queryset(hashing_vectorizer, project_data)
+        tfidf_transformer = TfidfTransformer().fit(counts)
+        tf_idf_matrix = sparse.csr_matrix(tfidf_transformer.transform(counts))
+        fitted_vectorizer = make_pipeline(hashing_vectorizer, tfidf_transformer)
+    else:
+        raise ValueError(
+            "There was no valid vectorizer for project: " + str(project_pk)
+        )
+
+    row_ids, row_offsets = build_row_index(id_list)
+
+    tf_idf = {
+        "matrix": tf_idf_matrix,
+        "row_ids": row_ids,
+        "row_offsets": row_offsets,
+        "max_data_pk": max_data_pk,
+        "oov_fraction": oov_fraction,
+        "vectorizer": vectorizer_type,
+    }
+
+    return tf_idf, fitted_vectorizer
+
+
+def iter_text_chunks(queryset, chunk_size=TRANSFORM_CHUNK_SIZE):
+    """Stream the upload_ids and text of some data in upload_id_hash order.
+
+    The rows come from a single server-side cursor, so only one chunk of text is
+    held in memory at a time no matter how large the project is.
+
+    Args:
+        queryset: Data queryset
+        chunk_size: number of rows in each chunk
+    Yields:
+        (upload_ids, texts) tuple for each chunk
     """
-    project_data = Data.objects.filter(project__pk=project_pk)
-    id_list = list(
-        project_data.values_list("upload_id", flat=True).order_by("upload_id_hash")
+    rows = (
+        queryset.order_by("upload_id_hash")
+        .values_list("upload_id", "text")
+        .iterator(chunk_size=chunk_size)
     )
-    data_list = list(
-        project_data.values_list("text", flat=True).order_by("upload_id_hash")
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield tuple(zip(*chunk))
+            chunk = []
+    if chunk:
+        yield tuple(zip(*chunk))
+
+
+def transform_queryset(vectorizer, queryset):
+    """Stream the text of some data through a fitted or stateless vectorizer.
+
+    Args:
+        vectorizer: fitted vectorizer
+        queryset: Data queryset
+    Returns:
+        id_list: list of upload_ids in matrix row order
+        matrix: CSR-format matrix with one row per datum
+    """
+    id_list = []
+
+    def text_chunks():
+        for ids, texts in iter_text_chunks(queryset):
+            id_list.extend(ids)
+            yield texts
+
+    matrix = transform_chunks(vectorizer, text_chunks())
+    return id_list, matrix
+
+
+def transform_texts(vectorizer, data_list):
+    """Transform text with a fitted or stateless vectorizer in chunks.
+
+    Args:
+        vectorizer: fitted vectorizer
+        data_list: list of text
+    Returns:
+        CSR-format matrix with one row per text
+    """
+    return transform_chunks(
+        vectorizer,
+        (
+            data_list[i : i + TRANSFORM_CHUNK_SIZE]
+            for i in range(0, len(data_list), TRANSFORM_CHUNK_SIZE)
+        ),
     )
 
-    vectorizer = TfidfVectorizer(max_df=max_df, min_df=min_df, stop_words="english")
-    fitted_vectorizer = vectorizer.fit(data_list)
 
-    tf_idf_matrix = fitted_vectorizer.transform(data_list)
+def transform_chunks(vectorizer, chunks):
+    """Transform chunks of text and stack the results in order.
+
+    The chunks are spread over settings.FEATURE_N_JOBS processes. Only a couple of
+    chunks per process are pulled from the iterable ahead of time, so a streamed
+    iterable is never read into memory all at once.
+
+    Args:
+        vectorizer: fitted vectorizer
+        chunks: iterable of lists of text
+    Returns:
+        CSR-format matrix with one row per text
+    """
+    if settings.FEATURE_N_JOBS == 1:
+        matrices = [vectorizer.transform(chunk) for chunk in chunks]
+    else:
+        matrices = Parallel(n_jobs=settings.FEATURE_N_JOBS, pre_dispatch="2*n_jobs")(
+            delayed(vectorizer.transform)(chunk) for chunk in chunks
+        )
+    if len(matrices) == 0:
+        return sparse.csr_matrix((0, vectorizer.transform([""]).shape[1]))
+    return sparse.vstack(matrices, format="csr")
+
+
+def build_row_index(id_list):
+    """Build a compact upload_id -> row offset index for a tf-idf matrix.
+
+    The upload_ids are stored sorted, next to the matrix row each one belongs to, so
+    that rows can be looked up with a binary search and the index can be memory mapped.
+
+    Args:
+        id_list: list of upload_ids in matrix row order
+    Returns:
+        row_ids: sorted array of upload_ids
+        row_offsets: array of matrix rows, aligned with row_ids
+    """
+    ids = np.array(id_list, dtype=str)
+    row_offsets = np.argsort(ids, kind="stable")
+    return ids[row_offsets], row_offsets
+
+
+def tfidf_oov_fraction(vectorizer, data_list):
+    """Return the fraction of tokens in the text which are not in the vocabulary of a
+    fitted vectorizer.
+
+    Args:
+        vectorizer: fitted TfidfVectorizer
+        data_list: list of text
+    Returns:
+        fraction between 0 and 1
+    """
+    if not hasattr(vectorizer, "vocabulary_"):
+        # hashing vectorizers have a fixed feature space, so nothing is out of it
+        return 0.0
+
+    analyzer = vectorizer.build_analyzer()
+    vocabulary = vectorizer.vocabulary_
+    num_tokens = 0
+    num_oov = 0
+    for text in data_list:
+        for token in analyzer(text):
+            num_tokens += 1
+            if token not in vocabulary:
+                num_oov += 1
+
+    if num_tokens == 0:
+        return 0.0
+    return num_oov / num_tokens
+
+
+def get_tfidf_rows(tf_idf, upload_ids):
+    """Slice the rows for the given upload_ids out of a tf-idf matrix.
+
+    Args:
+        tf_idf: dictionary as returned by create_tfidf_matrix or load_tfidf_matrix
+        upload_ids: list of upload_ids, rows are returned in this order
+    Returns:
+        X: CSR-format matrix with one row per upload_id
+    """
+    row_ids = tf_idf["row_ids"]
+    upload_ids = np.array(upload_ids, dtype=str)
+
+    positions = np.searchsorted(row_ids, upload_ids)
+    found = positions < len(row_ids)
+    found[found] = row_ids[positions[found]] == upload_ids[found]
+    if not np.all(found):
+        raise ValueError("Some of the data is missing from the tfidf matrix")
+
+    rows = np.asarray(tf_idf["row_offsets"][positions], dtype=np.int64)
+    return tf_idf["matrix"][rows]
 
-    new_dict = dict(
-        zip(id_list, np.matrix.tolist(sparse.csr_matrix.todense(tf_idf_matrix)))
+
+def get_tfidf_store_path(project_pk):
+    """Return the directory of the on-disk feature store for a project.
+
+    The store holds one subdirectory per version, each with the CSR arrays of the
+    tf-idf matrix and its row index saved as .npy files and the pickled vectorizer
+    the matrix was built with, plus a manifest.json that points at the current
+    version.
+    """
+    return os.path.join(
+        settings.TF_IDF_PATH, "project_" + str(project_pk) + "_tfidf_matrix"
     )
 
-    return new_dict, fitted_vectorizer
 
+def read_tfidf_manifest(project_pk):
+    """Read the feature store manifest for a project, otherwise None."""
+    fpath = os.path.join(get_tfidf_store_path(project_pk), "manifest.json")
+    if not os.path.isfile(fpath):
+        return None
+    with open(fpath, "r") as manifest_file:
+        return json.load(manifest_file)
+
+
+def get_tfidf_manifest(project_pk):
+    """Return the current feature store manifest of a project.
+
+    Projects whose features are still in the pickled matrix of older versions are
+    converted to a feature store on first use.
+
+    Args:
+        project_pk: The project pk the data comes from
+    Returns:
+        manifest dictionary
+    """
+    manifest = read_tfidf_manifest(project_pk)
+    if manifest is None:
+        manifest = convert_legacy_tfidf_matrix(project_pk)
+    if manifest is None:
+        raise ValueError(
+            "There was no tfidf matrix found for project: " + str(project_pk)
+        )
+    return manifest
+
+
+def convert_legacy_tfidf_matrix(project_pk):
+    """Rewrite a pickled tf-idf matrix and vectorizer as a feature store.
 
-def save_tfidf_matrix(matrix, project_pk):
+    The pickled matrix is a dictionary of upload_id to dense row.  The rows are
+    converted to CSR in chunks, so there is never a dense copy of the whole matrix.
+    Nothing records which data the matrix covered, so the next upload refits
+    instead of appending.
+
+    Args:
+        project_pk: The project pk the data comes from
+    Returns:
+        the manifest of the new store, or None if there is no pickled matrix
+    """
+    prefix = os.path.join(settings.TF_IDF_PATH, "project_" + str(project_pk))
+    matrix_path = prefix + "_tfidf_matrix.pkl"
+    vectorizer_path = prefix + "_vectorizer.pkl"
+    try:
+        with open(matrix_path, "rb") as matrix_file:
+            legacy_matrix = pickle.load(matrix_file)
+        vectorizer = None
+        if os.path.isfile(vectorizer_path):
+            with open(vectorizer_path, "rb") as vectorizer_file:
+                vectorizer = pickle.load(vectorizer_file)
+    except FileNotFoundError:
+        # not a legacy project, or another process has just converted it
+        return read_tfidf_manifest(project_pk)
+
+    id_list = list(legacy_matrix.keys())
+    rows = list(legacy_matrix.values())
+    del legacy_matrix
+    blocks = [
+        sparse.csr_matrix(np.array(rows[start : start + TRANSFORM_CHUNK_SIZE]))
+        for start in range(0, len(rows), TRANSFORM_CHUNK_SIZE)
+    ]
+    matrix = sparse.vstack(blocks or [sparse.csr_matrix((0, 0))], format="csr")
+    del rows
+    row_ids, row_offsets = build_row_index(id_list)
+    tf_idf = {
+        "matrix": matrix,
+        "row_ids": row_ids,
+        "row_offsets": row_offsets,
+        "max_data_pk": None,
+        "oov_fraction": 0.0,
+        "vectorizer": "tfidf",
+    }
+    save_tfidf_matrix(tf_idf, project_pk, vectorizer=vectorizer)
+
+    for fpath in [matrix_path, vectorizer_path]:
+        try:
+            os.remove(fpath)
+        except FileNotFoundError:
+            # removed by another process converting at the same time
+            pass
+    return read_tfidf_manifest(project_pk)
+
+
+def save_tfidf_matrix(matrix, project_pk, vectorizer=None):
     """Save tf-idf matrix to persistent volume storage defined in settings as
     TF_IDF_PATH.
 
+    Each save writes a new version of the feature store and then atomically swaps
+    the manifest over to it, so workers which still have the previous version
+    memory mapped are not affected.
+
     Args:
-        matrix: CSR-format tf-idf matrix
+        matrix: tf-idf dictionary (CSR matrix and row index)
         project_pk: The project pk the data comes from
+        vectorizer: the fitted vectorizer the matrix was built with, saved in the
+            same version as the matrix
     Returns:
-        file: The filepath to the saved matrix
+        file: The filepath to the saved manifest
     """
-    fpath = os.path.join(
-        settings.TF_IDF_PATH, "project_" + str(project_pk) + "_tfidf_matrix.pkl"
+    csr = sparse.csr_matrix(matrix["matrix"])
+    return write_tfidf_store(
+        project_pk,
+        {
+            "data": [csr.data],
+            "indices": [csr.indices],
+            "indptr": [csr.indptr],
+            "row_ids": [matrix["row_ids"]],
+            "row_offsets": [matrix["row_offsets"]],
+        },
+        csr.shape,
+        new_vectorizer=True,
+        vectorizer=vectorizer,
+        max_data_pk=matrix.get("max_data_pk"),
+        oov_fraction=matrix.get("oov_fraction"),
+        vectorizer_type=matrix.get("vectorizer", "tfidf"),
     )
-    with open(fpath, "wb") as tfidf_file:
-        pickle.dump(matrix, tfidf_file)
+
+
+def write_tfidf_store(
+    project_pk,
+    arrays,
+    shape,
+    new_vectorizer,
+    max_data_pk,
+    oov_fraction,
+    vectorizer_type=None,
+    vectorizer=None,
+):
+    """Write a new version of a project's feature store.
+
+    Every array is given as a list of parts which are concatenated straight into a
+    memory mapped .npy file, so appending to a large store never needs both the old
+    and the new matrix in memory.  The vectorizer is written into the version
+    before the manifest is swapped, so a matrix is never paired with another
+    version's vocabulary.  The version before the one replaced is deleted, readers
+    which have just read the previous manifest can still open its files.
+
+    Args:
+        project_pk: The project pk the data comes from
+        arrays: dictionary of array name to list of array parts
+        shape: shape of the CSR matrix
+        new_vectorizer: True if the matrix came from a newly fitted vectorizer
+        vectorizer: the fitted vectorizer, if None the vectorizer of the previous
+            version is carried over
+        max_data_pk: largest Data pk included in the matrix
+        oov_fraction: out-of-vocabulary token fraction when the vectorizer was fit
+        vectorizer_type: the project vectorizer option the matrix was built with
+    Returns:
+        file: The filepath to the saved manifest
+    """
+    store_path = get_tfidf_store_path(project_pk)
+    os.makedirs(store_path, exist_ok=True)
+
+    old_manifest = read_tfidf_manifest(project_pk)
+    if old_manifest is None:
+        version = 1
+        vectorizer_version = 1
+    else:
+        version = old_manifest["version"] + 1
+        vectorizer_version = old_manifest["vectorizer_version"] + int(new_vectorizer)
+
+    if new_vectorizer or old_manifest is None:
+        fitted_count = shape[0]
+    else:
+        fitted_count = old_manifest["fitted_count"]
+        oov_fraction = old_manifest["oov_fraction"]
+        vectorizer_type = old_manifest["vectorizer"]
+
+    version_dir = "v" + str(version)
+    version_path = os.path.join(store_path, version_dir)
+    os.makedirs(version_path, exist_ok=True)
+    nnz = 0
+    for name, parts in arrays.items():
+        size = save_array_parts(os.path.join(version_path, name + ".npy"), parts)
+        if name == "data":
+            nnz = size
+
+    vectorizer_path = os.path.join(version_path, "vectorizer.pkl")
+    if vectorizer is not None:
+        with open(vectorizer_path, "wb") as vectorizer_file:
+            pickle.dump(vectorizer, vectorizer_file)
+    elif old_manifest is not None:
+        old_vectorizer_path = os.path.join(
+            store_path, old_manifest["path"], "vectorizer.pkl"
+        )
+        if os.path.isfile(old_vectorizer_path):
+            shutil.copyfile(old_vectorizer_path, vectorizer_path)
+
+    manifest = {
+        "format": "csr",
+        "version": version,
+        "path": version_dir,
+        "vectorizer": vectorizer_type,
+        "vectorizer_version": vectorizer_version,
+        "sklearn_version": sklearn.__version__,
+        "data_count": shape[0],
+        "fitted_count": fitted_count,
+        "max_data_pk": max_data_pk,
+        "oov_fraction": oov_fraction,
+        "shape": list(shape),
+        "nnz": nnz,
+    }
+    fpath = os.path.join(store_path, "manifest.json")
+    with open(fpath + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(fpath + ".tmp", fpath)
+
+    if vectorizer is not None:
+        invalidate_artifact_cache(project_pk, "vectorizer")
+
+    # remove the versions before the previous one, any open memory maps keep their
+    # pages until closed
+    keep = {version_dir}
+    if old_manifest is not None:
+        keep.add(old_manifest["path"])
+    for name in os.listdir(store_path):
+        if name not in keep and os.path.isdir(os.path.join(store_path, name)):
+            shutil.rmtree(os.path.join(store_path, name), True)
 
     return fpath
 
 
-def save_tfidf_vectorizer(vectorizer, project_pk):
-    """Save tf-idf matrix to persistent volume storage defined in settings as
-    TF_IDF_PATH.
+def save_array_parts(fpath, parts):
+    """Concatenate a list of 1-d arrays into a single .npy file.
+
+    Returns:
+        size: the length of the saved array
+    """
+    parts = [np.asarray(part) for part in parts]
+    dtype = np.result_type(*parts)
+    size = sum(len(part) for part in parts)
+    if size == 0:
+        # an empty file cannot be memory mapped
+        np.save(fpath, np.empty(0, dtype=dtype))
+        return size
+
+    array = np.lib.format.open_memmap(fpath, mode="w+", dtype=dtype, shape=(size,))
+    start = 0
+    for part in parts:
+        array[start : start + len(part)] = part
+        start += len(part)
+    array.flush()
+    del array
+    return size
+
+
+def update_tfidf_matrix(project_pk, max_oov_drift=None):
+    """Append tf-idf rows for any data added since the matrix was last saved.
+
+    The new rows are transformed with the existing vocabulary and IDF weights. If
+    their out-of-vocabulary token fraction has drifted too far above the fraction
+    seen when the vectorizer was fit, nothing is saved and the caller should refit.
 
     Args:
-        matrix: CSR-format tf-idf matrix
         project_pk: The project pk the data comes from
+        max_oov_drift: allowed increase in the out-of-vocabulary fraction, defaults
+            to settings.TFIDF_MAX_OOV_DRIFT
     Returns:
-        file: The filepath to the saved matrix
+        file: The filepath to the saved manifest, or None if a refit is needed
     """
+    if max_oov_drift is None:
+        max_oov_drift = settings.TFIDF_MAX_OOV_DRIFT
+
+    manifest = read_tfidf_manifest(project_pk)
+    if manifest is None or manifest.get("max_data_pk") is None:
+        return None
+    if manifest["vectorizer"] != Project.objects.get(pk=project_pk).vectorizer:
+        return None
+
+    fpath = os.path.join(get_tfidf_store_path(project_pk), "manifest.json")
+    new_data = Data.objects.filter(
+        project__pk=project_pk, pk__gt=manifest["max_data_pk"]
+    ).order_by("pk")
+    new_rows = list(new_data.values_list("pk", "upload_id", "text"))
+    if len(new_rows) == 0:
+        return fpath
+    pk_list, id_list, data_list = zip(*new_rows)
+
+    # the vectorizer and matrix come from the same version of the store
+    vectorizer = load_tfidf_vectorizer(project_pk, manifest)
+    oov_fraction = tfidf_oov_fraction(vectorizer, data_list[:OOV_SAMPLE_SIZE])
+    if oov_fraction - manifest["oov_fraction"] > max_oov_drift:
+        return None
+
+    tf_idf = load_tfidf_matrix(project_pk, manifest)
+    old_matrix = tf_idf["matrix"]
+    new_matrix = transform_texts(vectorizer, data_list)
+    num_rows = old_matrix.shape[0] + new_matrix.shape[0]
+
+    # the new rows go at the end of the matrix, merge their ids into the index
+    ids = np.concatenate([tf_idf["row_ids"], np.array(id_list, dtype=str)])
+    offsets = np.concatenate(
+        [tf_idf["row_offsets"], np.arange(old_matrix.shape[0], num_rows)]
+    )
+    order = np.argsort(ids, kind="stable")
+
+    index_dtype = np.int32
+    if old_matrix.nnz + new_matrix.nnz > np.iinfo(np.int32).max:
+        index_dtype = np.int64
+
+    return write_tfidf_store(
+        project_pk,
+        {
+            "data": [old_matrix.data, new_matrix.data],
+            "indices": [
+                old_matrix.indices.astype(index_dtype, copy=False),
+                new_matrix.indices.astype(index_dtype, copy=False),
+            ],
+            "indptr": [
+                old_matrix.indptr.astype(index_dtype, copy=False),
+                new_matrix.indptr[1:].astype(index_dtype) + old_matrix.nnz,
+            ],
+            "row_ids": [ids[order]],
+            "row_offsets": [offsets[order]],
+        },
+        (num_rows, old_matrix.shape[1]),
+        new_vectorizer=False,
+        max_data_pk=max(pk_list),
+        oov_fraction=oov_fraction,
+    )
+
+
+def get_tfidf_vectorizer_file(project_pk, manifest=None):
+    """Return the path of the vectorizer in a version of the feature store.
+
+    Args:
+        project_pk: The project pk the data comes from
+        manifest: the manifest of the version, defaults to the current one
+    Returns:
+        file: The filepath to the pickled vectorizer
+    """
+    if manifest is None:
+        manifest = get_tfidf_manifest(project_pk)
     fpath = os.path.join(
-        settings.TF_IDF_PATH, "project_" + str(project_pk) + "_vectorizer.pkl"
+        get_tfidf_store_path(project_pk), manifest["path"], "vectorizer.pkl"
+    )
+    if os.path.isfile(fpath):
+        return fpath
+    raise ValueError(
+        "There was no tfidf vectorizer found for project: " + str(project_pk)
     )
-    with open(fpath, "wb") as tfidf_file:
-        pickle.dump(vectorizer, tfidf_file)
-    return fpath
 
 
-def load_tfidf_matrix(project_pk):
+def load_tfidf_vectorizer(project_pk, manifest=None):
+    """Load the fitted tf-idf vectorizer from persistent volume.
+
+    Args:
+        project_pk: The project pk the data comes from
+        manifest: the manifest of the version to load, defaults to the current one
+    Returns:
+        vectorizer
+    """
+    fpath = get_tfidf_vectorizer_file(project_pk, manifest)
+    return load_cached_artifact(("vectorizer", project_pk), fpath)
+
+
+def load_model_classifier(model):
+    """Load the fitted classifier of a model, reusing the copy already in memory
+    if this process has loaded it before.
+
+    The classifier is shared, so callers must not modify or refit it.
+
+    Args:
+        model: Model object
+    Returns:
+        clf: fitted classifier
+    """
+    key = ("classifier", model.project_id, model.training_set.set_number)
+    return load_cached_artifact(key, model.pickle_path)
+
+
+def load_cached_artifact(key, fpath):
+    """Unpickle a classifier or vectorizer through the process-level LRU cache.
+
+    Entries are also checked against the modification time of the file, so a
+    pickle rewritten by another process is never served stale.
+
+    Args:
+        key: tuple of the artifact kind, the project pk and optionally the training
+            set number
+        fpath: path to the pickle file
+    Returns:
+        the unpickled object
+    """
+    stamp = (fpath, os.stat(fpath).st_mtime_ns)
+    artifact = _artifact_cache.get(key, stamp)
+    if artifact is None:
+        artifact = joblib.load(fpath)
+        _artifact_cache.set(key, stamp, artifact)
+    return artifact
+
+
+def invalidate_artifact_cache(project_pk, kind=None):
+    """Drop the cached classifiers and vectorizers of a project.
+
+    Args:
+        project_pk: The project pk
+        kind: "classifier" or "vectorizer" to only drop one kind, or None for both
+    """
+    _artifact_cache.discard(lambda key: key[1] == project_pk and kind in (None, key[0]))
+
+
+def get_tfidf_matrix_files(project_pk):
+    """Return the files making up the current version of the feature store.
+
+    Args:
+        project_pk: The project pk the data comes from
+    Returns:
+        list of filepaths, the manifest first
+    """
+    manifest = get_tfidf_manifest(project_pk)
+    store_path = get_tfidf_store_path(project_pk)
+    version_path = os.path.join(store_path, manifest["path"])
+    return [os.path.join(store_path, "manifest.json")] + [
+        os.path.join(version_path, name + ".npy")
+        for name in ["data", "indices", "indptr", "row_ids", "row_offsets"]
+    ]
+
+
+def load_tfidf_matrix(project_pk, manifest=None):
     """Load tf-idf matrix from persistent volume, otherwise None.
 
+    The arrays are opened as read-only memory maps, so every process reading the
+    same version shares one page-cached copy instead of deserializing its own.
+
     Args:
         project_pk: The project pk the data comes from
+        manifest: the manifest of the version to load, defaults to the current one
     Returns:
         matrix or None
     """
-    fpath = os.path.join(
-        settings.TF_IDF_PATH, "project_" + str(project_pk) + "_tfidf_matrix.pkl"
+    if manifest is None:
+        manifest = get_tfidf_manifest(project_pk)
+
+    version_path = os.path.join(get_tfidf_store_path(project_pk), manifest["path"])
+    arrays = {
+        name: np.load(os.path.join(version_path, name + ".npy"), mmap_mode="r")
+        for name in ["data", "indices", "indptr", "row_ids", "row_offsets"]
+    }
+
+    tf_idf_matrix = sparse.csr_matrix(
+        (arrays["data"], arrays["indices"], arrays["indptr"]),
+        shape=tuple(manifest["shape"]),
+        copy=False,
     )
-
-    if os.path.isfile(fpath):
-        with open(fpath, "rb") as file:
-            return pickle.load(file)
-    else:
-        raise ValueError(
-            "There was no tfidf matrix found for project: " + str(project_pk)
-        )
+    return {
+        "matrix": tf_idf_matrix,
+        "row_ids": arrays["row_ids"],
+        "row_offsets": arrays["row_offsets"],
+        "manifest": manifest,
+    }
@@ -1,3 +1,4 @@
+import json
 import math
 
 from django.conf import settings
@@ -16,12 +17,53 @@ from core.models import (
     RecycleBin,
 )
 from core.utils.utils_redis import (
-    redis_parse_data,
-    redis_parse_queue,
+    get_redis_script,
+    redis_parse_pk,
+    redis_serialize_irr_seen,
+    redis_serialize_project_queues,
     redis_serialize_queue,
+    redis_serialize_set,
     sync_redis_objects,
 )
 
+# seconds the queues of a project are cached in redis
+PROJECT_QUEUES_TIMEOUT = 60 * 60
+
+# Lua script popping up to ARGV[1] items off the first nonempty queues in KEYS,
+# returning the queue key and data key of each
+POP_QUEUES_SCRIPT = """
+local result = {}
+local count = tonumber(ARGV[1])
+for _, k in ipairs(KEYS) do
+  while #result < 2 * count do
+    local m = redis.call('LPOP', k)
+    if not m then
+      break
+    end
+    table.insert(result, k)
+    table.insert(result, m)
+  end
+end
+return result
+"""
+
+# Lua script returning up to ARGV[1] items of the IRR list KEYS[1] which are still in
+# the IRR set KEYS[2] and not in the seen set KEYS[3] of a profile, and adding them to
+# the seen set.  Items no longer in the IRR set are dropped from the list.
+POP_IRR_SCRIPT = """
+local result = {}
+local count = tonumber(ARGV[1])
+for _, m in ipairs(redis.call('LRANGE', KEYS[1], 0, -1)) do
+  if redis.call('SISMEMBER', KEYS[2], m) == 0 then
+    redis.call('LREM', KEYS[1], 0, m)
+  elseif #result < count and redis.call('SISMEMBER', KEYS[3], m) == 0 then
+    redis.call('SADD', KEYS[3], m)
+    table.insert(result, m)
+  end
+end
+return result
+"""
+
 
 def find_queue_length(batch_size, num_coders):
     """Determine the length of the queue given by the batch_size and number of coders.
@@ -261,82 +303,132 @@ def get_queue_size_params(queue, queue_size, num_in_queue, batch_size, irr_queue
     return sample_size_sql, sample_size_params
 
 
-def pop_first_nonempty_queue(project, profile=None, type="normal"):
-    """Determine which queues are eligible to be popped (and in what order) and pass
-    them into redis to have the first nonempty one popped.
+def get_project_queues(project_pk):
+    """Return the queues of a project, cached in redis until the queues change.
 
-    Return a (queue, data item) tuple if one was found; return a (None, None) tuple if
-    not.
+    Args:
+        project_pk: primary key of the project
+    Returns:
+        list of [redis queue key, redis set key, profile pk or None, queue type]
+        lists, ordered by queue pk
+    """
+    key = redis_serialize_project_queues(project_pk)
+    cached = settings.REDIS.get(key)
+    if cached is not None:
+        return json.loads(cached)
+
+    queues = [
+        [
+            redis_serialize_queue(queue),
+            redis_serialize_set(queue),
+            queue.profile_id,
+            queue.type,
+        ]
+        for queue in Queue.objects.filter(project_id=project_pk).order_by("pk")
+    ]
+    settings.REDIS.set(key, json.dumps(queues), ex=PROJECT_QUEUES_TIMEOUT)
+    return queues
+
+
+def invalidate_project_queues(project_pk):
+    """Drop the cached queues of a project, see get_project_queues."""
+    settings.REDIS.delete(redis_serialize_project_queues(project_pk))
+
+
+def get_eligible_queues(project, profile=None, type="normal"):
+    """Determine which queues of a project a profile can pop from, in order.
+
+    Profile queues come before project queues, ties are broken by pk.
+
+    Returns:
+        list of entries of get_project_queues
     """
+    queues = [queue for queue in get_project_queues(project.pk) if queue[3] == type]
+    profile_queues = []
     if profile is not None:
-        # Use priority to ensure we set profile queues above project queues
-        # in the resulting list; break ties by pk
-        profile_queues = project.queue_set.filter(profile=profile, type=type)
-    else:
-        profile_queues = Queue.objects.none()
-    profile_queues = profile_queues.annotate(priority=Value(1, IntegerField()))
+        profile_queues = [queue for queue in queues if queue[2] == profile.pk]
+    project_queues = [queue for queue in queues if queue[2] is None]
+
+    return profile_queues + project_queues
+
+
+def get_eligible_queue_keys(project, profile=None, type="normal"):
+    """Return the redis keys of the queues a profile can pop from, in order.
+
+    Returns:
+        list of redis queue keys
+    """
+    return [queue[0] for queue in get_eligible_queues(project, profile, type)]
 
-    project_queues = project.queue_set.filter(profile=None, type=type).annotate(
-        priority=Value(2, IntegerField())
-    )
 
-    eligible_queue_ids = [
-        redis_serialize_queue(queue)
-        for queue in (profile_queues.union(project_queues).order_by("priority", "pk"))
+def pop_nonempty_queues(project, count, profile=None):
+    """Pop up to count data off the eligible normal queues with one redis call.
+
+    A Lua script pops the queues in order, moving on to the next queue once one is
+    empty, so the pops are atomic as a whole.
+
+    Args:
+        project: Project object
+        count: the number of data to pop
+        profile: Profile object whose queues come first, or None
+    Returns:
+        list of (queue pk, data pk) tuples, in the order they were popped
+    """
+    eligible_queue_ids = get_eligible_queue_keys(project, profile=profile)
+    if len(eligible_queue_ids) == 0 or count < 1:
+        return []
+
+    result = get_redis_script(POP_QUEUES_SCRIPT)(keys=eligible_queue_ids, args=[count])
+    return [
+        (redis_parse_pk(queue_key), redis_parse_pk(data_key))
+        for queue_key, data_key in zip(result[::2], result[1::2])
     ]
 
-    if type == "irr":
-        for queue_id in eligible_queue_ids:
-            queue = redis_parse_queue(queue_id.encode())
 
-            # first get the assigned data that was already labeled, or data already assigned
-            labeled_irr_data = DataLabel.objects.filter(profile=profile).values_list(
-                "data", flat=True
-            )
-            assigned_data = AssignedData.objects.filter(
-                profile=profile, queue=queue
-            ).values_list("data", flat=True)
-            skipped_data = IRRLog.objects.filter(
-                profile=profile, label__isnull=True
-            ).values_list("data", flat=True)
-            assigned_unlabeled = (
-                DataQueue.objects.filter(queue=queue)
-                .exclude(data__in=labeled_irr_data)
-                .exclude(data__in=assigned_data)
-                .exclude(data__in=skipped_data)
-            )
+def get_irr_candidates(project, profile, count):
+    """Find up to count IRR data a profile has not labeled, skipped or been assigned.
 
-            # if there are no elements, return none
-            if len(assigned_unlabeled) == 0:
-                return (None, None)
-            else:
-                # else, get the first element off the group and return it
-                datum = Data.objects.get(pk=assigned_unlabeled[0].data.pk)
-                return (queue, datum)
-    if len(eligible_queue_ids) == 0:
-        return (None, None)
+    IRR data is not popped from its queue, since every coder has to label it.
+    Instead a Lua script walks the shared IRR list in order, skipping the data no
+    longer in the IRR set and the data in the "seen" set of the profile, and adds
+    what it returns to the "seen" set, all atomically.
 
-    # Use a custom Lua script here to find the first nonempty queue atomically
-    # and pop its first item.  If all queues are empty, return nil.
-    script = settings.REDIS.register_script(
-        """
-    for _, k in pairs(KEYS) do
-      local m = redis.call('LPOP', k)
-      if m then
-        return {k, m}
-      end
-    end
-    return nil
+    Args:
+        project: Project object
+        profile: Profile object
+        count: the number of data to find
+    Returns:
+        list of (queue pk, data pk) tuples
     """
-    )
+    for queue_key, set_key, _, _ in get_eligible_queues(
+        project, profile=profile, type="irr"
+    ):
+        queue_pk = redis_parse_pk(queue_key.encode())
+        result = get_redis_script(POP_IRR_SCRIPT)(
+            keys=[queue_key, set_key, redis_serialize_irr_seen(queue_pk, profile.pk)],
+            args=[count],
+        )
+        # only the first queue is used
+        return [(queue_pk, redis_parse_pk(data_key)) for data_key in result]
+    return []
 
-    result = script(keys=eligible_queue_ids)
 
-    if result is None:
-        return (None, None)
+def pop_first_nonempty_queue(project, profile=None, type="normal"):
+    """Determine which queues are eligible to be popped (and in what order) and pass
+    them into redis to have the first nonempty one popped.
+
+    Return a (queue, data item) tuple if one was found; return a (None, None) tuple if
+    not.
+    """
+    if type == "irr":
+        popped = get_irr_candidates(project, profile, 1)
     else:
-        queue_key, data_key = result
-        return (redis_parse_queue(queue_key), redis_parse_data(data_key))
+        popped = pop_nonempty_queues(project, 1, profile=profile)
+
+    if len(popped) == 0:
+        return (None, None)
+    queue_pk, data_pk = popped[0]
+    return (Queue.objects.get(pk=queue_pk), Data.objects.get(pk=data_pk))
 
 
 def pop_queue(queue):
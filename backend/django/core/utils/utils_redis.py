@@ -1,8 +1,32 @@
+import time
+import uuid
+from contextlib import contextmanager
+
 from django.conf import settings
 from django.db.models import Max, Min
 from django.db.utils import ProgrammingError
 
-from core.models import AssignedData, Data, Queue
+from core.models import AssignedData, Data, DataLabel, IRRLog, Queue
+
+# seconds before a task slot is considered abandoned by a killed worker
+TASK_SLOT_TIMEOUT = 6 * 60 * 60
+
+# Lua script adding the token ARGV[4] with the start time ARGV[1] to the sorted set
+# of running tasks KEYS[1] if it has fewer than ARGV[3] members, after dropping the
+# members started more than ARGV[2] seconds ago.  Returns 1 if the token was added.
+ACQUIRE_TASK_SLOT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local timeout = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - timeout)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+  return 0
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('EXPIRE', KEYS[1], timeout)
+return 1
+"""
+
+_registered_scripts = {}
 
 
 def redis_serialize_queue(queue):
@@ -29,6 +53,68 @@ def redis_serialize_data(datum):
     return "data:" + str(datum.pk)
 
 
+def redis_serialize_project_tasks(project_pk):
+    """Serialize the sorted set of the running heavy tasks of a project.
+
+    The format is 'task_slots:<project pk>'
+    """
+    return "task_slots:" + str(project_pk)
+
+
+def redis_serialize_irr_seen(queue_pk, profile_pk):
+    """Serialize the set of the IRR data a profile was assigned from an IRR queue.
+
+    The format is 'irr_seen:<queue pk>:<profile pk>'
+    """
+    return "irr_seen:" + str(queue_pk) + ":" + str(profile_pk)
+
+
+def redis_serialize_project_queues(project_pk):
+    """Serialize the key caching the queues of a project.
+
+    The format is 'project_queues:<project pk>'
+    """
+    return "project_queues:" + str(project_pk)
+
+
+def get_redis_script(source):
+    """Register a Lua script once per process and return it.
+
+    The returned script is called by its SHA, and redis-py loads it again
+    if the server does not have it yet.
+    """
+    script = _registered_scripts.get(source)
+    if script is None:
+        script = settings.REDIS.register_script(source)
+        _registered_scripts[source] = script
+    return script
+
+
+def get_redis_version(key):
+    """Return the version string stored under a redis key.
+
+    A new version is made up if the key is missing.  Both happen in one round trip.
+
+    Args:
+        key: the redis key of the version
+    Returns:
+        version string
+    """
+    pipeline = settings.REDIS.pipeline()
+    pipeline.set(key, uuid.uuid4().hex, nx=True)
+    pipeline.get(key)
+    return pipeline.execute()[1].decode()
+
+
+def bump_redis_version(key):
+    """Replace the version stored under a redis key with a new one.
+
+    Args:
+        key: the redis key of the version
+    """
+    settings.REDIS.set(key, uuid.uuid4().hex)
+
+
 def redis_parse_queue(queue_key):
     """Parse a queue key from redis and return the Queue object."""
     queue_pk = queue_key.decode().split(":")[1]
@@ -41,6 +127,11 @@ def redis_parse_data(datum_key):
     return Data.objects.get(pk=datum_pk)
 
 
+def redis_parse_pk(key):
+    """Parse a queue or datum key from redis and return the primary key."""
+    return int(key.decode().split(":")[1])
+
+
 def redis_parse_list_dataids(data_ids):
     """Parse a list of redis data ids and return a list of primary key strings."""
     return [d.decode().split(":")[1] for d in data_ids]
@@ -107,16 +198,24 @@ def init_redis():
 
     existing_queue_keys = [key for key in settings.REDIS.scan_iter("queue:*")]
     existing_set_keys = [key for key in settings.REDIS.scan_iter("set:*")]
+    existing_seen_keys = [key for key in settings.REDIS.scan_iter("irr_seen:*")]
     if len(existing_queue_keys) > 0:
         # We'll get an error if we try to del without any keys
         pipeline.delete(*existing_queue_keys)
     if len(existing_set_keys) > 0:
         pipeline.delete(*existing_set_keys)
+    if len(existing_seen_keys) > 0:
+        pipeline.delete(*existing_seen_keys)
 
     pipeline.execute()
 
     for queue in Queue.objects.all():
-        data_ids = [d.pk for d in queue.data.all() if d.pk not in assigned_data_ids]
+        # IRR data stays in its queue while assigned, every coder has to label it
+        data_ids = [
+            d.pk
+            for d in queue.data.all()
+            if queue.type == "irr" or d.pk not in assigned_data_ids
+        ]
         data_ids = [
             redis_serialize_data(d)
             for d in get_ordered_data(data_ids, "least confident")
@@ -126,9 +225,44 @@ def init_redis():
             pipeline.sadd(redis_serialize_set(queue), *data_ids)
             pipeline.lpush(redis_serialize_queue(queue), *data_ids)
 
+        if queue.type == "irr":
+            for profile_pk, data_pks in get_irr_seen_data(queue).items():
+                pipeline.sadd(
+                    redis_serialize_irr_seen(queue.pk, profile_pk),
+                    *["data:" + str(pk) for pk in data_pks],
+                )
+
     pipeline.execute()
 
 
+def get_irr_seen_data(queue):
+    """Find the data of an IRR queue each profile was assigned, labeled or skipped.
+
+    Args:
+        queue: the IRR Queue object
+    Returns:
+        dict of profile pk to the set of data pks
+    """
+    queue_data = queue.data.values_list("pk", flat=True)
+    seen = (
+        AssignedData.objects.filter(queue=queue)
+        .values_list("profile_id", "data_id")
+        .union(
+            DataLabel.objects.filter(data__in=queue_data).values_list(
+                "profile_id", "data_id"
+            ),
+            IRRLog.objects.filter(data__in=queue_data, label__isnull=True).values_list(
+                "profile_id", "data_id"
+            ),
+        )
+    )
+
+    seen_data = {}
+    for profile_pk, data_pk in seen:
+        seen_data.setdefault(profile_pk, set()).add(data_pk)
+    return seen_data
+
+
 def sync_redis_objects(queue, orderby):
     """Given a DataQueue sync the redis set with the DataQueue and then update the redis
     queue with the appropriate new ordered data."""
@@ -151,10 +285,11 @@ def sync_redis_objects(queue, orderby):
             redis_set_data.difference(set(redis_queue_data))
         )
 
-        # IDs not already assigned
-        new_data_ids = set(new_data_ids).difference(
-            [str(a.data.pk) for a in AssignedData.objects.filter(queue=queue)]
-        )
+        # IDs not already assigned, IRR data stays in the queue while assigned
+        if queue.type != "irr":
+            new_data_ids = set(new_data_ids).difference(
+                [str(a.data.pk) for a in AssignedData.objects.filter(queue=queue)]
+            )
 
         ordered_data_ids = [
             redis_serialize_data(d) for d in get_ordered_data(new_data_ids, orderby)
@@ -162,3 +297,38 @@ def sync_redis_objects(queue, orderby):
 
         if len(ordered_data_ids) > 0:
             settings.REDIS.rpush(redis_serialize_queue(queue), *ordered_data_ids)
+
+
+@contextmanager
+def project_task_slot(project_pk):
+    """Hold one of the settings.PROJECT_TASK_CONCURRENCY slots for heavy tasks of a
+    project while the block runs.
+
+    Each slot is a token in a sorted set scored by its start time.  Tokens older
+    than TASK_SLOT_TIMEOUT seconds are dropped when a slot is requested, so a
+    killed worker frees its slot after the timeout no matter how often the waiting
+    tasks retry.
+
+    Args:
+        project_pk: The project pk
+    Yields:
+        True if a slot was acquired, False if the project is already at its limit
+    """
+    key = redis_serialize_project_tasks(project_pk)
+    token = uuid.uuid4().hex
+    acquired = bool(
+        get_redis_script(ACQUIRE_TASK_SLOT_SCRIPT)(
+            keys=[key],
+            args=[
+                time.time(),
+                TASK_SLOT_TIMEOUT,
+                settings.PROJECT_TASK_CONCURRENCY,
+                token,
+            ],
+        )
+    )
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            settings.REDIS.zrem(key, token)
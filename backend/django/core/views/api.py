@@ -15,6 +15,11 @@ from core.permissions import IsAdminOrCreator
 from core.templatetags import project_extras
 from core.utils.util import get_labeled_data
 from core.utils.utils_external_db import export_table, load_ingest_table
+from core.utils.utils_model import (
+    get_tfidf_matrix_files,
+    get_tfidf_store_path,
+    get_tfidf_vectorizer_file,
+)
 
 
 @api_view(["GET"])
@@ -60,12 +65,8 @@ def download_model(request, project_pk, unverified):
     # https://stackoverflow.com/questions/12881294/django-create-a-zip-of-multiple-files-and-make-it-downloadable
     zip_subdir = "model_project" + str(project_pk)
 
-    tfidf_path = os.path.join(
-        settings.TF_IDF_PATH, "project_" + str(project_pk) + "_tfidf_matrix.pkl"
-    )
-    tfidf_vectorizer_path = os.path.join(
-        settings.TF_IDF_PATH, "project_" + str(project_pk) + "_vectorizer.pkl"
-    )
+    tfidf_store_path = get_tfidf_store_path(project_pk)
+    tfidf_vectorizer_path = get_tfidf_vectorizer_file(project_pk)
     readme_path = os.path.join(settings.BASE_DIR, "core", "data", "README.pdf")
     dockerfile_path = os.path.join(settings.BASE_DIR, "core", "data", "Dockerfile")
     requirements_path = os.path.join(
@@ -109,7 +110,6 @@ def download_model(request, project_pk, unverified):
     # open the zip folder
     zip_file = zipfile.ZipFile(s, "w")
     for path in [
-        tfidf_path,
         tfidf_vectorizer_path,
         readme_path,
         model_path,
@@ -121,13 +121,23 @@ def download_model(request, project_pk, unverified):
         usage_examples_path,
     ]:
         fdir, fname = os.path.split(path)
-        if path == temp_label_file.name:
+        if path == tfidf_vectorizer_path:
+            fname = "project_" + str(project_pk) + "_vectorizer.pkl"
+        elif path == temp_label_file.name:
             fname = "project_" + str(project_pk) + "_labels.csv"
         elif path == temp_labeleddata_file.name:
             fname = "project_" + str(project_pk) + "_labeled_data.csv"
         # write the file to the zip folder
         zip_path = os.path.join(zip_subdir, fname)
         zip_file.write(path, zip_path)
+    # the feature store files keep their layout relative to the store directory
+    for path in get_tfidf_matrix_files(project_pk):
+        zip_path = os.path.join(
+            zip_subdir,
+            os.path.basename(tfidf_store_path),
+            os.path.relpath(path, tfidf_store_path),
+        )
+        zip_file.write(path, zip_path)
     zip_file.close()
 
     response = HttpResponse(s.getvalue(), content_type="application/x-zip-compressed")
@@ -23,7 +23,12 @@ from core.models import (
 from core.permissions import IsAdminOrCreator, IsCoder
 from core.utils.util import irr_heatmap_data, perc_agreement_table_data, project_status
 from core.utils.utils_annotate import leave_coding_page, unassign_datum
-from core.utils.utils_model import cohens_kappa, fleiss_kappa
+from core.utils.utils_model import (
+    cohens_kappa,
+    fleiss_kappa,
+    get_training_progress,
+    supersede_model_task,
+)
 
 
 @api_view(["GET"])
@@ -124,7 +129,9 @@ def model_metrics(request, project_pk):
     metric = request.GET.get("metric", "accuracy")
 
     project = Project.objects.get(pk=project_pk)
-    models = Model.objects.filter(project=project).order_by("training_set__set_number")
+    models = Model.objects.filter(project=project, cv_accuracy__isnull=False).order_by(
+        "training_set__set_number"
+    )
 
     if metric == "accuracy":
         values = []
@@ -366,3 +373,37 @@ def unassign_coders(request, project_pk, profile_id):
         unassign_datum(d, profile)
 
     return Response(project_status(project))
+
+
+@api_view(["GET"])
+@permission_classes((IsAdminOrCreator,))
+def model_progress(request, project_pk):
+    """This returns the progress of the model currently being trained.
+
+    Args:
+        request: The GET request
+        project_pk: Primary key of the project
+    Returns:
+        the task id, state, current stage and the seconds spent per stage
+    """
+    project = Project.objects.get(pk=project_pk)
+
+    return Response(get_training_progress(project))
+
+
+@api_view(["POST"])
+@permission_classes((IsAdminOrCreator,))
+def cancel_model(request, project_pk):
+    """Cancel the model currently being trained, and by default start a new one on
+    the labels available now.
+
+    Args:
+        request: The POST request, with an optional "restart" flag
+        project_pk: Primary key of the project
+    Returns:
+        the id of the new task, if one was started
+    """
+    project = Project.objects.get(pk=project_pk)
+    restart = str(request.data.get("restart", "true")).lower() == "true"
+
+    return Response({"task_id": supersede_model_task(project, restart)})
@@ -3,15 +3,16 @@ import random
 
 import pandas as pd
 from django.conf import settings
+from django.contrib.postgres.search import TrigramWordSimilarity
 from django.db import transaction
 from django.db.models import Q
+from django.db.models.functions import Greatest
 from django.utils import timezone
 from psycopg2.errors import UniqueViolation
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.generics import ListAPIView
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from sentence_transformers import SentenceTransformer, util
 
 from core.models import (
     AdjudicateDescription,
@@ -23,14 +24,12 @@ from core.models import (
     IRRLog,
     Label,
     LabelChangeLog,
-    LabelEmbeddings,
     MetaData,
     MetaDataField,
     Project,
     Queue,
     RecycleBin,
     VerifiedDataLabel,
-    LabelMetaData,
 )
 from core.pagination import LabelViewPagination
 from core.permissions import IsAdminOrCreator, IsCoder
@@ -42,11 +41,10 @@ from core.serializers import (
     LabelSerializer,
 )
 from core.templatetags import project_extras
+from core.utils import utils_embeddings
 from core.utils.utils_annotate import (
-    cache_embeddings,
     createUnresolvedAdjudicateMessage,
     get_assignments,
-    get_embeddings,
     get_unlabeled_data,
     label_data,
     leave_coding_page,
@@ -54,50 +52,81 @@ from core.utils.utils_annotate import (
     process_irr_label,
     update_last_action,
 )
-from core.utils.utils_model import check_and_trigger_model
+from core.utils.utils_label_search import get_label_search_index, tokenize
+from core.utils.utils_model import check_and_trigger_model, reset_labeled_count
 from core.utils.utils_queue import fill_queue
-from core.utils.utils_redis import redis_serialize_data, redis_serialize_set
+from core.utils.utils_redis import (
+    redis_serialize_data,
+    redis_serialize_irr_seen,
+    redis_serialize_set,
+)
 from smart.settings import ADMIN_TIMEOUT_MINUTES
 
-# Using a prebuilt model
-# How this model was built: https://github.com/dsteedRTI/csv-to-embeddings-model
-# Sbert Model can be found here: https://www.sbert.net/docs/pretrained_models.html
-# Sbert Model Card: https://huggingface.co/sentence-transformers/multi-qa-mpnet-base-dot-v1
-model_path = "core/smart_embeddings_model"
-embeddings_model = SentenceTransformer(model_path)
-
 
 @permission_classes((IsCoder,))
 class SearchLabelsView(ListAPIView):
     serializer_class = LabelSerializer
     pagination_class = LabelViewPagination
 
+    def get_category(self):
+        """Return the label category value requested, or None for all labels."""
+        label_category = self.request.GET.get("category")
+        if not label_category or label_category == "all":
+            return None
+        return "nan" if label_category == "None" else label_category
+
+    def list(self, request, *args, **kwargs):
+        """Answer the search from the in-memory label search index of the project.
+
+        Search strings without any word characters are left to the database.
+        """
+        project = Project.objects.get(pk=self.kwargs["project_pk"])
+        filter_text = request.GET.get("searchString") or ""
+        if filter_text.strip() and not tokenize(filter_text):
+            return super().list(request, *args, **kwargs)
+
+        labels = get_label_search_index(project).search(
+            filter_text, self.get_category()
+        )
+        page = self.paginate_queryset(labels)
+        return self.get_paginated_response(page)
+
     def get_queryset(self):
         """This view should return a list of all the labels which contain a particular
-        string."""
+        string, best matches first.
+
+        The substring filter is served by the trigram indexes on the label name and
+        description, and matches are ranked by their trigram word similarity to the
+        search string.
+        """
         project = Project.objects.get(pk=self.kwargs["project_pk"])
         filter_text = self.request.GET.get("searchString")
 
-        label_category = self.request.GET.get("category")
-        if label_category and label_category != "all":
-            if label_category == "None":
-                category_label_list = LabelMetaData.objects.filter(
-                    label_metadata_field=project.category.label_metadata_field,
-                    value="nan",
-                ).values_list("label__pk", flat=True)
-            else:
-                category_label_list = LabelMetaData.objects.filter(
-                    label_metadata_field=project.category.label_metadata_field,
-                    value=label_category,
-                ).values_list("label__pk", flat=True)
-            return Label.objects.filter(
-                project=project, pk__in=category_label_list
-            ).filter(
-                Q(name__icontains=filter_text) | Q(description__icontains=filter_text)
+        labels = Label.objects.filter(project=project).prefetch_related(
+            "labelmetadata__label_metadata_field"
+        )
+
+        label_category = self.get_category()
+        if label_category is not None:
+            labels = labels.filter(
+                labelmetadata__label_metadata_field=project.category.label_metadata_field,
+                labelmetadata__value=label_category,
             )
 
-        return Label.objects.filter(project=project).filter(
-            Q(name__icontains=filter_text) | Q(description__icontains=filter_text)
+        if not filter_text:
+            return labels
+
+        return (
+            labels.filter(
+                Q(name__icontains=filter_text) | Q(description__icontains=filter_text)
+            )
+            .annotate(
+                rank=Greatest(
+                    TrigramWordSimilarity(filter_text, "name"),
+                    TrigramWordSimilarity(filter_text, "description"),
+                )
+            )
+            .order_by("-rank", "pk")
         )
 
 
@@ -260,8 +289,16 @@ def unassign_data(request, data_pk):
     response = {}
     if AssignedData.objects.filter(data=data, profile=profile).exists():
         assignment = AssignedData.objects.get(data=data, profile=profile)
+        queue = assignment.queue
         assignment.delete()
 
+        # IRR data stays in its queue, let the coder get it again
+        if queue.type == "irr":
+            settings.REDIS.srem(
+                redis_serialize_irr_seen(queue.pk, profile.pk),
+                redis_serialize_data(data),
+            )
+
     return Response(response)
 
 
@@ -750,7 +787,7 @@ def embeddings_calculations(request):
         data: a list of data information
     """
 
-    embeddings = embeddings_model.encode(request.data["strings"])
+    embeddings = utils_embeddings.encode(request.data["strings"])
 
     return Response(embeddings)
 
@@ -758,76 +795,26 @@ def embeddings_calculations(request):
 @api_view(["GET"])
 @permission_classes((IsCoder,))
 def embeddings_comparison(request, project_pk):
-    """This finds the highest scoring labels when comparing cosine similarity scores of
-    their embeddingsfor a given input string.
+    """This returns the labels whose description embeddings are most similar to the
+    embedding of a datum.
+
+    The suggestions are computed once per datum and cached until the label
+    embeddings change (see utils_embeddings.get_label_suggestions).
 
     Args:
-        text: The input string
-        request: The GET request
+        request: The GET request, with the dataID of the datum
         project_pk: Primary key of the project
     Returns:
         data: a list of data information
     """
     project = Project.objects.get(pk=project_pk)
-    project_labels = Label.objects.filter(project=project)
-
-    data_pk = request.GET.get("dataID")
-    data_obj = Data.objects.get(pk=data_pk)
-
-    embeddings_category = None
-
-    if hasattr(project, "category"):
-        # filter the labels to be the same category value as the data
-        if MetaData.objects.filter(
-            data=data_obj, metadata_field=project.category.data_metadata_field
-        ).exists():
-            data_metadata_obj = MetaData.objects.get(
-                data=data_obj, metadata_field=project.category.data_metadata_field
-            )
-            if (
-                (data_metadata_obj.value is not None)
-                and (data_metadata_obj.value.strip() != "")
-                and (
-                    data_metadata_obj.value
-                    in project.category.label_metadata_field.get_unique_options()
-                )
-            ):
-                embeddings_category = data_metadata_obj.value
-                label_metadata_obj = LabelMetaData.objects.filter(
-                    label_metadata_field=project.category.label_metadata_field,
-                    value=data_metadata_obj.value,
-                )
-                project_labels = project_labels.filter(
-                    pk__in=label_metadata_obj.values_list("label__pk", flat=True)
-                )
-
-    # if the subset is less than 5 just return everything
-    if len(project_labels) <= 5:
-        return Response(
-            {"suggestions": LabelSerializer(project_labels, many=True).data}
-        )
+    data_obj = Data.objects.get(pk=request.GET.get("dataID"))
 
-    # Request and cache label embeddings
-    cached_embeddings = get_embeddings(project_pk, embeddings_category)
-    if cached_embeddings:
-        project_labels_embeddings = cached_embeddings
-    else:
-        project_labels_embeddings = list(
-            LabelEmbeddings.objects.filter(label_id__in=project_labels).values_list(
-                "embedding", flat=True
-            )
-        )
-        cache_embeddings(project_pk, embeddings_category, project_labels_embeddings)
-
-    text = request.GET.get("text")
-    text_embedding = embeddings_model.encode(text)
-
-    cosine_scores = util.pytorch_cos_sim(text_embedding, project_labels_embeddings)
-    values, indices = cosine_scores[0].topk(5)
-
-    suggestions = []
-    for index in indices:
-        suggestions.append(LabelSerializer(project_labels[int(index)]).data)
+    suggestion_pks = utils_embeddings.get_label_suggestions(project, data_obj)
+    labels = Label.objects.in_bulk(suggestion_pks)
+    suggestions = [
+        LabelSerializer(labels[pk]).data for pk in suggestion_pks if pk in labels
+    ]
 
     return Response({"suggestions": suggestions})
 
@@ -984,6 +971,8 @@ def label_skew_label(request, data_pk):
             settings.REDIS.srem(
                 redis_serialize_set(normal_queue), redis_serialize_data(datum)
             )
+        # skew labels bypass check_and_trigger_model, so recount on the next label
+        reset_labeled_count(current_training_set)
 
     else:
         response["error"] = "Invalid permission. Must be an admin."
@@ -331,6 +331,8 @@ class ProjectCreateWizard(LoginRequiredMixin, SessionWizardView):
             proj_obj.percentage_irr = advanced_data["percentage_irr"]
             proj_obj.num_users_irr = advanced_data["num_users_irr"]
             proj_obj.classifier = advanced_data["classifier"]
+            proj_obj.vectorizer = advanced_data["vectorizer"]
+            proj_obj.prediction_top_k = advanced_data["prediction_top_k"]
             proj_obj.allow_coders_view_labels = advanced_data[
                 "allow_coders_view_labels"
             ]
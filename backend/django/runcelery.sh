@@ -9,4 +9,15 @@ while [ $n -ne 0 ]; do
     n=$?
 done
 
-celery -A smart worker -l info -n default@%h
+# heavy training and vectorizing tasks get their own pool so they never starve
+# the light bookkeeping tasks
+celery -A smart worker -l info -Q heavy -n heavy@%h \
+    -c "${CELERY_HEAVY_CONCURRENCY:-2}" --prefetch-multiplier=1 &
+celery -A smart worker -l info -Q light -n light@%h \
+    -c "${CELERY_LIGHT_CONCURRENCY:-4}" &
+# encoding uploaded data is slow too, but should never delay a model run
+celery -A smart worker -l info -Q embeddings -n embeddings@%h \
+    -c "${CELERY_EMBEDDINGS_CONCURRENCY:-1}" --prefetch-multiplier=1 &
+
+# stop when either worker exits so the container restarts
+wait -n
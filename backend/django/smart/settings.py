@@ -47,6 +47,7 @@ class Dev(Configuration):
         "django.contrib.sessions",
         "django.contrib.messages",
         "django.contrib.staticfiles",
+        "django.contrib.postgres",
         "django_extensions",
         "django_celery_results",
         "rest_framework",
@@ -203,6 +204,25 @@ class Dev(Configuration):
     CELERY_ACCEPT_CONTENT = ["json"]
     CELERY_TASK_SERIALIZER = "json"
     CELERY_RESULT_SERIALIZER = "json"
+    # Training and vectorizing go to their own workers so long runs for one project
+    # do not hold up the quick bookkeeping tasks of others, and the embeddings of
+    # uploaded data get a worker of their own so uploads do not hold up training,
+    # see runcelery.sh
+    CELERY_TASK_DEFAULT_QUEUE = "light"
+    CELERY_TASK_ROUTES = {
+        "core.tasks.send_model_task": {"queue": "heavy"},
+        "core.tasks.send_model_evaluation_task": {"queue": "heavy"},
+        "core.tasks.send_tfidf_creation_task": {"queue": "heavy"},
+        "core.tasks.send_label_embeddings_task": {"queue": "embeddings"},
+        "core.tasks.send_data_embeddings_task": {"queue": "embeddings"},
+        "core.tasks.send_prune_predictions_task": {"queue": "heavy"},
+    }
+    # Number of training or vectorizing tasks allowed to run at once per project,
+    # seconds to wait before retrying one over the limit and how many times to retry
+    # it before giving up, by default a little longer than a slot can be held
+    PROJECT_TASK_CONCURRENCY = int(os.environ.get("PROJECT_TASK_CONCURRENCY", 1))
+    PROJECT_TASK_RETRY_DELAY = int(os.environ.get("PROJECT_TASK_RETRY_DELAY", 30))
+    PROJECT_TASK_MAX_RETRIES = int(os.environ.get("PROJECT_TASK_MAX_RETRIES", 800))
 
     STATICFILES_DIRS = [
         os.path.join(BASE_DIR, "frontend", "dist"),
@@ -229,6 +249,45 @@ class Dev(Configuration):
     ADMIN_TIMEOUT_MINUTES = 15
     PROJECT_SUGGESTION_MAX = os.environ.get("PROJECT_SUGGESTION_MAX", 10000)
 
+    # Refit the tf-idf vectorizer instead of appending new data once the share of
+    # out-of-vocabulary tokens grows by more than this since the last fit
+    TFIDF_MAX_OOV_DRIFT = float(os.environ.get("TFIDF_MAX_OOV_DRIFT", 0.1))
+
+    # Number of processes used to vectorize text chunks
+    FEATURE_N_JOBS = int(os.environ.get("FEATURE_N_JOBS", 1))
+
+    # Number of processes used to predict chunks of unlabeled data
+    PREDICT_N_JOBS = int(os.environ.get("PREDICT_N_JOBS", 1))
+
+    # Number of most recent models per project whose predictions and uncertainty
+    # scores are kept, older rounds are deleted after each training run
+    PREDICTION_RETENTION_MODELS = int(os.environ.get("PREDICTION_RETENTION_MODELS", 2))
+
+    # Start fitting logistic regression models from the coefficients of the previous
+    # model of the project, so each round converges in fewer iterations
+    MODEL_WARM_START = os.environ.get("MODEL_WARM_START", "true").lower() == "true"
+
+    # How the accuracy and metrics of each model are estimated, one of "kfold",
+    # "holdout" or "rolling". This runs in its own task after predictions are saved
+    MODEL_EVALUATION = os.environ.get("MODEL_EVALUATION", "kfold")
+    MODEL_EVALUATION_FOLDS = int(os.environ.get("MODEL_EVALUATION_FOLDS", 5))
+    MODEL_EVALUATION_HOLDOUT = float(os.environ.get("MODEL_EVALUATION_HOLDOUT", 0.2))
+    MODEL_EVALUATION_N_JOBS = int(os.environ.get("MODEL_EVALUATION_N_JOBS", 1))
+
+    # Seconds to wait after a batch fills before training, so labels arriving from
+    # other coders in that window join the same round
+    MODEL_TRIGGER_DELAY = int(os.environ.get("MODEL_TRIGGER_DELAY", 0))
+
+    # Send text embedding requests to the batching embeddings worker
+    # (manage.py run_embeddings_worker) instead of encoding in the web process
+    EMBEDDINGS_SERVICE = os.environ.get("EMBEDDINGS_SERVICE", "false").lower() == "true"
+    # Most texts encoded in one batch, and milliseconds the worker waits for more
+    # requests to fill a batch
+    EMBEDDINGS_BATCH_SIZE = int(os.environ.get("EMBEDDINGS_BATCH_SIZE", 64))
+    EMBEDDINGS_MAX_WAIT_MS = int(os.environ.get("EMBEDDINGS_MAX_WAIT_MS", 10))
+    # Seconds to wait for the worker before encoding in the web process
+    EMBEDDINGS_TIMEOUT = int(os.environ.get("EMBEDDINGS_TIMEOUT", 5))
+
 
 class Prod(Dev):
     DEBUG = False
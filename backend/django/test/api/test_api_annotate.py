@@ -12,6 +12,7 @@ from core.models import (
     DataLabel,
     DataQueue,
     IRRLog,
+    Label,
     LabelChangeLog,
     Profile,
     ProjectPermissions,
@@ -1014,3 +1015,24 @@ def test_admin_counts(
     ).json()
     assert "detail" not in response and len(response["data"]) == 1
     assert response["data"]["SKIP"] == 60
+
+
+def test_search_labels_ranked(seeded_database, client, test_project_data, test_queue):
+    """Label search returns the matching labels, closest matches first."""
+    project = test_project_data
+    sign_in_and_fill_queue(project, test_queue, client)
+    for name, description in [
+        ("pineapple", "a fruit"),
+        ("grape", "a fruit"),
+        ("dessert", "apple pie"),
+    ]:
+        Label.objects.create(name=name, description=description, project=project)
+
+    response = client.get(
+        "/api/search_labels/" + str(project.pk) + "/", {"searchString": "apple"}
+    )
+
+    assert [label["name"] for label in response.json()["results"]] == [
+        "dessert",
+        "pineapple",
+    ]
@@ -10,7 +10,6 @@ from core.utils.utils_model import (
     create_tfidf_matrix,
     predict_data,
     save_tfidf_matrix,
-    save_tfidf_vectorizer,
     train_and_save_model,
 )
 from core.utils.utils_queue import add_queue
@@ -250,8 +249,11 @@ def test_project_labeled_and_tfidf(
 ):
     data_temp = tmpdir.mkdir("data").mkdir("tf_idf")
     settings.TF_IDF_PATH = str(data_temp)
-    save_tfidf_matrix(test_tfidf_matrix_labeled, test_project_labeled.pk)
-    save_tfidf_vectorizer(test_tfidf_vectorizer_labeled, test_project_labeled.pk)
+    save_tfidf_matrix(
+        test_tfidf_matrix_labeled,
+        test_project_labeled.pk,
+        vectorizer=test_tfidf_vectorizer_labeled,
+    )
     return test_project_labeled
 
 
@@ -3,6 +3,7 @@ from test.util import assert_obj_exists
 
 from core.models import AssignedData, Data, DataLabel, DataQueue, Label
 from core.utils.utils_annotate import (
+    assign_data,
     assign_datum,
     get_assignments,
     label_data,
@@ -230,6 +231,32 @@ def test_get_assignments_multiple_existing_assignments(
     assert len(data) == len(assigned_data)
 
 
+def test_assign_data_batch(
+    db,
+    test_profile,
+    test_project_data,
+    test_queue,
+    test_redis,
+    django_assert_max_num_queries,
+):
+    fill_queue(test_queue, orderby="random")
+    queue_key = "queue:" + str(test_queue.pk)
+    expected_pks = [
+        int(key.decode().split(":")[1]) for key in test_redis.lrange(queue_key, 0, 9)
+    ]
+
+    # the whole batch takes a fixed number of queries
+    with django_assert_max_num_queries(8):
+        data = assign_data(test_profile, test_project_data, 10)
+
+    assert [datum.pk for datum in data] == expected_pks
+    assert test_redis.llen(queue_key) == test_queue.length - 10
+    assert (
+        AssignedData.objects.filter(profile=test_profile, queue=test_queue).count()
+        == 10
+    )
+
+
 def test_unassign(db, test_profile, test_project_data, test_queue, test_redis):
     fill_queue(test_queue, orderby="random")
 
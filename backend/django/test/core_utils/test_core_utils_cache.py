@@ -0,0 +1,41 @@
+from core.utils.utils_cache import LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.set("a", "v1", 1)
+    cache.set("b", "v1", 2)
+
+    assert cache.get("a", "v1") == 1
+    # a value cached under another stamp is a miss
+    assert cache.get("a", "v2") is None
+
+    # "b" is the least recently used value, so it is dropped first
+    cache.set("c", "v1", 3)
+    assert cache.get("b", "v1") is None
+    assert cache.get("a", "v1") == 1
+
+    cache.discard(lambda key: key in ["a", "c"])
+    assert cache.get("a", "v1") is None
+    assert cache.get("c", "v1") is None
+
+
+def test_lru_cache_weighted():
+    cache = LRUCache(10, weigh=len)
+    cache.set("a", "v1", "x" * 4)
+    cache.set("b", "v1", "x" * 4)
+
+    # "a" is dropped to make room for "c"
+    cache.set("c", "v1", "x" * 4)
+    assert cache.get("a", "v1") is None
+    assert cache.get("b", "v1") == "xxxx"
+
+    # replacing a value releases its old weight
+    cache.set("b", "v2", "x" * 6)
+    assert cache.get("b", "v2") == "x" * 6
+    assert cache.get("c", "v1") == "xxxx"
+
+    # a value heavier than the whole cache is not kept
+    cache.set("d", "v1", "x" * 11)
+    assert cache.get("d", "v1") is None
+    assert cache.get("c", "v1") == "xxxx"
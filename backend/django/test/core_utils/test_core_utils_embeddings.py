@@ -0,0 +1,248 @@
+import json
+import time
+
+import numpy as np
+
+from core.models import Data, DataEmbeddings, Label, LabelEmbeddings
+from core.utils import utils_embeddings
+from core.utils.util import generate_label_embeddings
+from core.utils.utils_embeddings import (
+    EMBEDDINGS_MAX_QUEUED_REQUESTS,
+    EMBEDDINGS_REQUEST_QUEUE,
+    LabelIndex,
+    cache_label_embeddings,
+    create_data_embeddings,
+    encode,
+    get_cached_label_embeddings,
+    get_label_embeddings_cache_stats,
+    get_label_index,
+    get_label_suggestions,
+    invalidate_label_embeddings,
+    process_embedding_requests,
+    redis_serialize_embeddings_reply,
+    search_label_index,
+)
+
+
+class LengthEncoder:
+    """A tiny stand-in for the sentence transformer which records its batches."""
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts):
+        self.batches.append(texts)
+        if isinstance(texts, str):
+            return np.array([len(texts), 1.0])
+        return np.array([[len(text), 1.0] for text in texts])
+
+
+def test_process_embedding_requests_batches(test_redis, settings, monkeypatch):
+    encoder = LengthEncoder()
+    monkeypatch.setattr(utils_embeddings, "get_embeddings_model", lambda: encoder)
+    settings.EMBEDDINGS_BATCH_SIZE = 10
+    settings.EMBEDDINGS_MAX_WAIT_MS = 50
+
+    deadline = time.time() + 60
+    for request_id, texts in [("a", ["one", "three"]), ("b", ["seven"])]:
+        test_redis.rpush(
+            EMBEDDINGS_REQUEST_QUEUE,
+            json.dumps({"id": request_id, "texts": texts, "deadline": deadline}),
+        )
+
+    assert process_embedding_requests(block_timeout=1) == 2
+
+    # both requests were encoded in a single call
+    assert encoder.batches == [["one", "three", "seven"]]
+    reply = test_redis.lpop(redis_serialize_embeddings_reply("a"))
+    np.testing.assert_array_equal(
+        np.frombuffer(reply, dtype=np.float32).reshape(2, -1), [[3, 1], [5, 1]]
+    )
+    reply = test_redis.lpop(redis_serialize_embeddings_reply("b"))
+    np.testing.assert_array_equal(np.frombuffer(reply, dtype=np.float32), [5, 1])
+
+
+def test_process_embedding_requests_drops_expired(test_redis, settings, monkeypatch):
+    encoder = LengthEncoder()
+    monkeypatch.setattr(utils_embeddings, "get_embeddings_model", lambda: encoder)
+    settings.EMBEDDINGS_MAX_WAIT_MS = 10
+
+    test_redis.rpush(
+        EMBEDDINGS_REQUEST_QUEUE,
+        json.dumps({"id": "a", "texts": ["one"], "deadline": time.time() - 1}),
+    )
+
+    # the caller has stopped waiting, so the request is not encoded
+    assert process_embedding_requests(block_timeout=1) == 0
+    assert encoder.batches == []
+    assert not test_redis.exists(redis_serialize_embeddings_reply("a"))
+
+
+def test_encode_bulk_skips_worker(test_redis, settings, monkeypatch):
+    encoder = LengthEncoder()
+    monkeypatch.setattr(utils_embeddings, "get_embeddings_model", lambda: encoder)
+    settings.EMBEDDINGS_SERVICE = True
+    settings.EMBEDDINGS_BATCH_SIZE = 2
+
+    encode(["one", "two", "three"])
+    encode(["four"], service=False)
+
+    # neither request was sent to the worker
+    assert not test_redis.exists(EMBEDDINGS_REQUEST_QUEUE)
+    assert encoder.batches == [["one", "two", "three"], ["four"]]
+
+
+def test_encode_falls_back_without_worker(test_redis, settings, monkeypatch):
+    encoder = LengthEncoder()
+    monkeypatch.setattr(utils_embeddings, "get_embeddings_model", lambda: encoder)
+    settings.EMBEDDINGS_SERVICE = True
+    settings.EMBEDDINGS_TIMEOUT = 1
+
+    embedding = encode("four")
+
+    np.testing.assert_array_equal(embedding, [4, 1])
+    assert encoder.batches == ["four"]
+
+
+def test_encode_full_queue_fails_fast(test_redis, settings, monkeypatch):
+    encoder = LengthEncoder()
+    monkeypatch.setattr(utils_embeddings, "get_embeddings_model", lambda: encoder)
+    settings.EMBEDDINGS_SERVICE = True
+    settings.EMBEDDINGS_TIMEOUT = 30
+    test_redis.rpush(EMBEDDINGS_REQUEST_QUEUE, *["{}"] * EMBEDDINGS_MAX_QUEUED_REQUESTS)
+
+    # nobody is reading the queue, so the text is encoded here without waiting
+    started = time.time()
+    embedding = encode("four")
+    assert time.time() - started < settings.EMBEDDINGS_TIMEOUT
+    np.testing.assert_array_equal(embedding, [4, 1])
+    assert test_redis.llen(EMBEDDINGS_REQUEST_QUEUE) == EMBEDDINGS_MAX_QUEUED_REQUESTS
+    assert 0 < test_redis.ttl(EMBEDDINGS_REQUEST_QUEUE) <= settings.EMBEDDINGS_TIMEOUT
+
+
+def create_described_labels(project, num_labels=6):
+    """Create labels whose descriptions get longer with the label number."""
+    return [
+        Label.objects.create(
+            name="label " + str(i), description="a" * i, project=project
+        )
+        for i in range(1, num_labels + 1)
+    ]
+
+
+def test_create_data_embeddings(test_project_data, monkeypatch):
+    encoder = LengthEncoder()
+    monkeypatch.setattr(utils_embeddings, "get_embeddings_model", lambda: encoder)
+    create_described_labels(test_project_data)
+    num_data = Data.objects.filter(project=test_project_data).count()
+
+    assert create_data_embeddings(test_project_data.pk, chunk_size=100) == num_data
+
+    datum = Data.objects.filter(project=test_project_data).first()
+    embedding = np.frombuffer(
+        DataEmbeddings.objects.get(data=datum).embedding, dtype=np.float32
+    )
+    np.testing.assert_array_equal(embedding, [len(datum.text), 1])
+    # only data without embeddings is encoded
+    assert create_data_embeddings(test_project_data.pk) == 0
+
+
+def test_label_suggestions_cached_until_invalidated(
+    test_project_data, test_redis, monkeypatch
+):
+    encoder = LengthEncoder()
+    monkeypatch.setattr(utils_embeddings, "get_embeddings_model", lambda: encoder)
+    labels = create_described_labels(test_project_data)
+    generate_label_embeddings(test_project_data)
+    datum = Data.objects.filter(project=test_project_data).first()
+    DataEmbeddings.objects.create(
+        data=datum, embedding=np.array([1, 0], dtype=np.float32).tobytes()
+    )
+
+    # the longer the description, the closer its embedding is to the datum
+    expected = [label.pk for label in labels[:0:-1]]
+    assert get_label_suggestions(test_project_data, datum) == expected
+
+    LabelEmbeddings.objects.filter(label=labels[0]).update(embedding=[1000.0, 1.0])
+    assert get_label_suggestions(test_project_data, datum) == expected
+
+    invalidate_label_embeddings(test_project_data.pk)
+    assert get_label_suggestions(test_project_data, datum)[0] == labels[0].pk
+
+
+def test_generate_label_embeddings_only_new_labels(
+    test_project_data, test_redis, monkeypatch
+):
+    encoder = LengthEncoder()
+    monkeypatch.setattr(utils_embeddings, "get_embeddings_model", lambda: encoder)
+    labels = create_described_labels(test_project_data)
+    generate_label_embeddings(test_project_data)
+    assert len(encoder.batches[0]) == len(labels)
+    index = get_label_index(test_project_data)
+
+    # with every label embedded, nothing is encoded and the cache is kept
+    generate_label_embeddings(test_project_data)
+    assert len(encoder.batches) == 1
+    assert get_label_index(test_project_data) is index
+
+    label = Label.objects.create(
+        name="new", description="a new label", project=test_project_data
+    )
+    generate_label_embeddings(test_project_data)
+    assert encoder.batches[-1] == [label.description]
+    assert LabelEmbeddings.objects.filter(label__project=test_project_data).count() == (
+        len(labels) + 1
+    )
+
+
+def test_search_label_index():
+    matrix = np.array([[1, 0], [0, 1], [0.6, 0.8], [0.8, 0.6]], dtype=np.float32)
+    index = LabelIndex(4, np.array([10, 11, 12, 13]), matrix)
+
+    assert search_label_index(index, [1, 0.1], k=2) == [10, 13]
+    assert search_label_index(index, [0, 1], k=10) == [11, 12, 13, 10]
+    assert search_label_index(LabelIndex(0, np.array([]), None), [1, 0]) == []
+
+
+def test_label_index_rebuilt_after_invalidation(
+    test_project_data, test_redis, monkeypatch
+):
+    encoder = LengthEncoder()
+    monkeypatch.setattr(utils_embeddings, "get_embeddings_model", lambda: encoder)
+    labels = create_described_labels(test_project_data)
+    generate_label_embeddings(test_project_data)
+
+    index = get_label_index(test_project_data)
+    assert index.num_labels == len(labels)
+    assert index.label_ids.tolist() == [label.pk for label in labels]
+    assert index.matrix.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(index.matrix, axis=1), 1, rtol=1e-6)
+    assert get_label_index(test_project_data) is index
+
+    invalidate_label_embeddings(test_project_data.pk)
+    assert get_label_index(test_project_data) is not index
+
+
+def test_label_embeddings_cache(test_redis):
+    stats = get_label_embeddings_cache_stats()
+    index = LabelIndex(3, np.array([4, 5, 6]), np.eye(3, dtype=np.float32))
+
+    assert get_cached_label_embeddings(1, "a b", "v1") is None
+    cache_label_embeddings(1, "a b", "v1", index)
+    cached = get_cached_label_embeddings(1, "a b", "v1")
+    assert cached.num_labels == 3
+    np.testing.assert_array_equal(cached.label_ids, index.label_ids)
+    np.testing.assert_array_equal(cached.matrix, index.matrix)
+    # other categories and versions are separate entries
+    assert get_cached_label_embeddings(1, None, "v1") is None
+    assert get_cached_label_embeddings(1, "a b", "v2") is None
+
+    # an index without embeddings is still a hit
+    cache_label_embeddings(1, None, "v1", LabelIndex(2, np.array([]), None))
+    cached = get_cached_label_embeddings(1, None, "v1")
+    assert cached.num_labels == 2 and cached.matrix is None
+
+    assert get_label_embeddings_cache_stats() == {
+        "hits": stats["hits"] + 2,
+        "misses": stats["misses"] + 3,
+    }
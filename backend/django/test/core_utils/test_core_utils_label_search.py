@@ -0,0 +1,49 @@
+import pandas as pd
+
+from core.models import Label
+from core.utils.util import update_label_descriptions_metadata
+from core.utils.utils_label_search import get_label_search_index
+
+
+def test_label_search_index(test_project_data, test_redis):
+    project = test_project_data
+    for name, description in [
+        ("pineapple", "a fruit"),
+        ("grape", "a fruit"),
+        ("dessert", "apple pie"),
+        ("apple tree", ""),
+    ]:
+        Label.objects.create(name=name, description=description, project=project)
+    index = get_label_search_index(project)
+
+    def search(text):
+        return [label["name"] for label in index.search(text)]
+
+    # name prefix, then whole words, then matches inside a word
+    assert search("apple") == ["apple tree", "dessert", "pineapple"]
+    assert search("FRUI") == ["pineapple", "grape"]
+    assert search("e pi") == ["pineapple", "dessert"]
+    assert search("") == ["pineapple", "grape", "dessert", "apple tree"]
+    assert search("kiwi") == []
+
+
+def test_label_search_index_invalidated_on_update(test_project_data, test_redis):
+    project = test_project_data
+    for name in ["pineapple", "grape"]:
+        Label.objects.create(name=name, project=project)
+    index = get_label_search_index(project)
+    assert index.search("purple") == []
+    assert get_label_search_index(project) is index
+
+    update_label_descriptions_metadata(
+        project,
+        pd.DataFrame(
+            {"Label": ["grape"], "Description": ["purple"], "Color": ["purple"]}
+        ),
+    )
+
+    index = get_label_search_index(project)
+    results = index.search("purple")
+    assert [label["name"] for label in results] == ["grape"]
+    assert results[0]["name"] == "grape"
+    assert results[0]["description"].startswith("purple")
@@ -1,10 +1,17 @@
 import os
+import pickle
 from test.conftest import TEST_QUEUE_LEN
 from test.util import assert_obj_exists, assert_redis_matches_db
+from types import SimpleNamespace
 
+import joblib
 import numpy as np
 import pytest
+from celery.exceptions import Ignore
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
 
+from core import tasks
 from core.models import (
     Data,
     DataLabel,
@@ -14,30 +21,123 @@ from core.models import (
     Model,
     ProjectPermissions,
 )
+from core.utils.util import md5_hash
 from core.utils.utils_annotate import assign_datum, label_data
 from core.utils.utils_model import (
+    HASHING_N_FEATURES,
+    acquire_training_lock,
     check_and_trigger_model,
     cohens_kappa,
+    create_tfidf_matrix,
     entropy,
+    evaluate_model,
     fleiss_kappa,
+    get_labeled_features,
+    get_tfidf_matrix_files,
+    get_tfidf_rows,
+    get_tfidf_store_path,
+    get_tfidf_vectorizer_file,
+    get_training_progress,
+    incr_labeled_count,
+    iter_text_chunks,
     least_confident,
+    load_model_classifier,
     load_tfidf_matrix,
+    load_tfidf_vectorizer,
     margin_sampling,
     predict_data,
+    prune_old_predictions,
+    read_tfidf_manifest,
+    redis_serialize_training_set,
+    report_training_progress,
     save_tfidf_matrix,
+    set_labeled_count,
+    supersede_model_task,
     train_and_save_model,
+    update_tfidf_matrix,
 )
 from core.utils.utils_queue import fill_queue, find_queue_length
 from core.utils.utils_redis import get_ordered_data
 
 
 def test_create_tfidf_matrix(test_tfidf_matrix):
-    # UPDATE: is now saved as a dictionary of lists
+    # UPDATE: is now saved as a sparse matrix with a row index of upload_ids
     assert isinstance(test_tfidf_matrix, dict)
-    assert len(test_tfidf_matrix) == 982
-    for key in test_tfidf_matrix:
-        assert len(test_tfidf_matrix[key]) == 162
-        assert np.all([type(val) == float for val in test_tfidf_matrix[key]])
+    assert sparse.isspmatrix_csr(test_tfidf_matrix["matrix"])
+    assert test_tfidf_matrix["matrix"].shape == (982, 162)
+    assert len(test_tfidf_matrix["row_ids"]) == 982
+    assert list(test_tfidf_matrix["row_ids"]) == sorted(test_tfidf_matrix["row_ids"])
+    assert sorted(test_tfidf_matrix["row_offsets"]) == list(range(982))
+
+
+def test_create_tfidf_matrix_hashing(test_project_data):
+    test_project_data.vectorizer = "hashing"
+    test_project_data.save()
+
+    tf_idf, vectorizer = create_tfidf_matrix(test_project_data.pk)
+
+    assert isinstance(vectorizer, HashingVectorizer)
+    assert tf_idf["vectorizer"] == "hashing"
+    assert tf_idf["oov_fraction"] == 0.0
+    assert tf_idf["matrix"].shape == (982, HASHING_N_FEATURES)
+
+    # the feature space is fixed, so new text needs no fit
+    new_rows = vectorizer.transform(["some brand new text"])
+    assert new_rows.shape == (1, HASHING_N_FEATURES)
+
+
+def test_create_tfidf_matrix_hashing_tfidf(test_project_data):
+    test_project_data.vectorizer = "hashing tfidf"
+    test_project_data.save()
+    texts = list(
+        Data.objects.filter(project=test_project_data)
+        .order_by("upload_id_hash")
+        .values_list("text", flat=True)
+    )
+
+    tf_idf, vectorizer = create_tfidf_matrix(test_project_data.pk)
+
+    assert tf_idf["matrix"].shape == (982, HASHING_N_FEATURES)
+    rows = get_tfidf_rows(tf_idf, list(tf_idf["row_ids"][:5]))
+    expected = vectorizer.transform(
+        [texts[offset] for offset in tf_idf["row_offsets"][:5]]
+    )
+    assert np.allclose(rows.toarray(), expected.toarray())
+
+
+def test_iter_text_chunks(test_project_data):
+    project_data = Data.objects.filter(project=test_project_data)
+    chunks = list(iter_text_chunks(project_data, chunk_size=100))
+
+    assert len(chunks) == 10
+    assert all(len(ids) == len(texts) == 100 for ids, texts in chunks[:-1])
+    assert len(chunks[-1][0]) == 82
+
+    expected = list(
+        project_data.order_by("upload_id_hash").values_list("upload_id", "text")
+    )
+    streamed = [row for ids, texts in chunks for row in zip(ids, texts)]
+    assert streamed == expected
+
+
+def test_get_tfidf_rows(test_tfidf_matrix):
+    upload_ids = list(test_tfidf_matrix["row_ids"][:10][::-1])
+
+    rows = get_tfidf_rows(test_tfidf_matrix, upload_ids)
+
+    assert sparse.isspmatrix_csr(rows)
+    assert rows.shape == (10, 162)
+    for i, offset in enumerate(test_tfidf_matrix["row_offsets"][:10][::-1]):
+        assert np.allclose(
+            rows[i].toarray(), test_tfidf_matrix["matrix"][offset].toarray()
+        )
+
+
+def test_get_tfidf_rows_missing(test_tfidf_matrix):
+    with pytest.raises(ValueError) as excinfo:
+        get_tfidf_rows(test_tfidf_matrix, ["not an upload id"])
+
+    assert "missing from the tfidf matrix" in str(excinfo.value)
 
 
 def test_save_tfidf_matrix(test_project_data, test_tfidf_matrix, tmpdir, settings):
@@ -49,8 +149,34 @@ def test_save_tfidf_matrix(test_project_data, test_tfidf_matrix, tmpdir, setting
     assert os.path.isfile(file)
     assert file == os.path.join(
         settings.TF_IDF_PATH,
-        "project_" + str(test_project_data.pk) + "_tfidf_matrix.pkl",
+        "project_" + str(test_project_data.pk) + "_tfidf_matrix",
+        "manifest.json",
     )
+    manifest = read_tfidf_manifest(test_project_data.pk)
+    assert manifest["version"] == 1
+    assert manifest["vectorizer_version"] == 1
+    assert manifest["data_count"] == 982
+    for path in get_tfidf_matrix_files(test_project_data.pk):
+        assert os.path.isfile(path)
+
+    # saving again writes a new version and keeps the previous one for its readers
+    save_tfidf_matrix(test_tfidf_matrix, test_project_data.pk)
+    manifest = read_tfidf_manifest(test_project_data.pk)
+    assert manifest["version"] == 2
+    assert manifest["vectorizer_version"] == 2
+    assert sorted(os.listdir(get_tfidf_store_path(test_project_data.pk))) == [
+        "manifest.json",
+        "v1",
+        "v2",
+    ]
+
+    # the version before the previous one is removed on the next save
+    save_tfidf_matrix(test_tfidf_matrix, test_project_data.pk)
+    assert sorted(os.listdir(get_tfidf_store_path(test_project_data.pk))) == [
+        "manifest.json",
+        "v2",
+        "v3",
+    ]
 
 
 def test_load_tfidf_matrix(
@@ -58,9 +184,110 @@ def test_load_tfidf_matrix(
 ):
     matrix = load_tfidf_matrix(test_project_labeled_and_tfidf.pk)
 
-    for key in matrix:
-        assert key in test_tfidf_matrix_labeled
-        assert np.allclose(matrix[key], test_tfidf_matrix_labeled[key])
+    assert isinstance(matrix["row_ids"], np.memmap)
+    assert np.array_equal(matrix["row_ids"], test_tfidf_matrix_labeled["row_ids"])
+    assert np.array_equal(
+        matrix["row_offsets"], test_tfidf_matrix_labeled["row_offsets"]
+    )
+    assert np.allclose(
+        matrix["matrix"].toarray(), test_tfidf_matrix_labeled["matrix"].toarray()
+    )
+
+
+def test_load_legacy_tfidf_matrix(
+    test_project_labeled,
+    test_tfidf_matrix_labeled,
+    test_tfidf_vectorizer_labeled,
+    tmpdir,
+    settings,
+):
+    data_temp = tmpdir.mkdir("data").mkdir("tf_idf")
+    settings.TF_IDF_PATH = str(data_temp)
+    prefix = os.path.join(
+        settings.TF_IDF_PATH, "project_" + str(test_project_labeled.pk)
+    )
+    dense = test_tfidf_matrix_labeled["matrix"].toarray()
+    row_ids = test_tfidf_matrix_labeled["row_ids"]
+    row_offsets = test_tfidf_matrix_labeled["row_offsets"]
+    with open(prefix + "_tfidf_matrix.pkl", "wb") as matrix_file:
+        pickle.dump(
+            {
+                upload_id: dense[offset].tolist()
+                for upload_id, offset in zip(row_ids, row_offsets)
+            },
+            matrix_file,
+        )
+    with open(prefix + "_vectorizer.pkl", "wb") as vectorizer_file:
+        pickle.dump(test_tfidf_vectorizer_labeled, vectorizer_file)
+
+    # the pickled matrix is converted to a feature store on first use
+    matrix = load_tfidf_matrix(test_project_labeled.pk)
+    assert not os.path.exists(prefix + "_tfidf_matrix.pkl")
+    assert read_tfidf_manifest(test_project_labeled.pk)["max_data_pk"] is None
+    rows = get_tfidf_rows(matrix, list(row_ids))
+    assert np.allclose(rows.toarray(), dense[row_offsets])
+    assert load_tfidf_vectorizer(test_project_labeled.pk).vocabulary_ == (
+        test_tfidf_vectorizer_labeled.vocabulary_
+    )
+
+
+def add_test_data(project, texts):
+    """Insert data directly, as if it had been appended by a later upload."""
+    return [
+        Data.objects.create(
+            text=text,
+            project=project,
+            hash=md5_hash(text),
+            upload_id="appended_" + str(i),
+            upload_id_hash=md5_hash("appended_" + str(i)),
+        )
+        for i, text in enumerate(texts)
+    ]
+
+
+def test_update_tfidf_matrix(test_project_labeled_and_tfidf):
+    project = test_project_labeled_and_tfidf
+    old_manifest = read_tfidf_manifest(project.pk)
+    vectorizer = load_tfidf_vectorizer(project.pk)
+    texts = list(
+        Data.objects.filter(project=project)
+        .order_by("pk")
+        .values_list("text", flat=True)[:5]
+    )
+    new_data = add_test_data(project, texts)
+
+    file = update_tfidf_matrix(project.pk, max_oov_drift=1.0)
+
+    assert os.path.isfile(file)
+    manifest = read_tfidf_manifest(project.pk)
+    assert manifest["version"] == old_manifest["version"] + 1
+    assert manifest["vectorizer_version"] == old_manifest["vectorizer_version"]
+    assert manifest["data_count"] == old_manifest["data_count"] + 5
+    assert manifest["fitted_count"] == old_manifest["data_count"]
+    assert manifest["max_data_pk"] == new_data[-1].pk
+
+    # the appended rows use the existing vocabulary and IDF weights
+    matrix = load_tfidf_matrix(project.pk)
+    rows = get_tfidf_rows(matrix, [d.upload_id for d in new_data])
+    assert np.allclose(rows.toarray(), vectorizer.transform(texts).toarray())
+
+    # the vectorizer is carried over into the new version
+    assert os.path.dirname(get_tfidf_vectorizer_file(project.pk)).endswith(
+        manifest["path"]
+    )
+
+    # nothing new to add leaves the store alone
+    assert update_tfidf_matrix(project.pk) == file
+    assert read_tfidf_manifest(project.pk)["version"] == manifest["version"]
+
+
+def test_update_tfidf_matrix_drift(test_project_labeled_and_tfidf):
+    project = test_project_labeled_and_tfidf
+    old_manifest = read_tfidf_manifest(project.pk)
+    add_test_data(project, ["zyzzyva quokka axolotl", "quokka zyzzyva"])
+
+    assert update_tfidf_matrix(project.pk, max_oov_drift=0.1) is None
+    assert read_tfidf_manifest(project.pk) == old_manifest
 
 
 def test_least_confident_notarray():
@@ -177,6 +404,18 @@ def test_entropy_with_zero():
     np.testing.assert_almost_equal(e, 0.26529499557412151)
 
 
+def test_uncertainty_metrics_rows():
+    probs = np.array([[0.1, 0.3, 0.6], [0.7, 0.2, 0.1], [0, 0.3, 0.7]])
+
+    np.testing.assert_almost_equal(least_confident(probs), [0.4, 0.3, 0.3])
+    np.testing.assert_almost_equal(margin_sampling(probs), [0.3, 0.5, 0.4])
+    np.testing.assert_almost_equal(
+        entropy(probs), [entropy(row) for row in probs], decimal=12
+    )
+    # the input is not sorted in place
+    assert probs[0].tolist() == [0.1, 0.3, 0.6]
+
+
 def test_train_and_save_model(test_project_labeled_and_tfidf, tmpdir, settings):
     project = test_project_labeled_and_tfidf
 
@@ -198,6 +437,80 @@ def test_train_and_save_model(test_project_labeled_and_tfidf, tmpdir, settings):
     )
 
 
+def test_train_and_save_model_warm_start(test_project_with_trained_model, settings):
+    project = test_project_with_trained_model
+    settings.MODEL_WARM_START = True
+    previous_clf = joblib.load(project.model_set.get().pickle_path)
+    assert not previous_clf.warm_start
+
+    model = train_and_save_model(project)
+
+    clf = joblib.load(model.pickle_path)
+    assert clf.warm_start
+    np.testing.assert_array_equal(clf.classes_, previous_clf.classes_)
+
+
+def test_train_and_save_model_no_warm_start(test_project_with_trained_model, settings):
+    project = test_project_with_trained_model
+    settings.MODEL_WARM_START = False
+
+    model = train_and_save_model(project)
+
+    assert not joblib.load(model.pickle_path).warm_start
+
+
+@pytest.mark.parametrize("strategy", ["kfold", "holdout", "rolling"])
+def test_evaluate_model(test_project_with_trained_model, strategy):
+    project = test_project_with_trained_model
+    model = project.model_set.get()
+    assert model.cv_accuracy is None
+
+    # rolling has no previous model to score yet, so it falls back to kfold
+    model = evaluate_model(model, strategy)
+
+    model.refresh_from_db()
+    assert 0 <= model.cv_accuracy <= 1
+    label_pks = {str(label.pk) for label in project.labels.all()}
+    for metric in ("precision", "recall", "f1"):
+        assert set(model.cv_metrics[metric].keys()) == label_pks
+
+
+def test_evaluate_model_rolling(test_project_with_trained_model, test_profile):
+    project = test_project_with_trained_model
+    label = project.labels.first()
+    new_data = project.data_set.filter(datalabel__isnull=True)[:10]
+    for datum in new_data:
+        DataLabel.objects.create(
+            data=datum,
+            label=label,
+            profile=test_profile,
+            training_set=project.get_current_training_set(),
+        )
+    new_model = train_and_save_model(project)
+
+    model = evaluate_model(new_model, "rolling")
+
+    # only the ten new labels are scored, by the previous model
+    previous_clf = joblib.load(project.model_set.order_by("pk").first().pickle_path)
+    X, _ = get_labeled_features(
+        project, DataLabel.objects.filter(data__in=list(new_data))
+    )
+    expected = np.mean(previous_clf.predict(X) == label.pk)
+    np.testing.assert_almost_equal(model.cv_accuracy, expected)
+
+
+def test_load_model_classifier_cache(test_project_with_trained_model):
+    project = test_project_with_trained_model
+    model = project.model_set.get()
+
+    clf = load_model_classifier(model)
+    assert load_model_classifier(model) is clf
+
+    # creating a new model drops the cached classifiers of the project
+    train_and_save_model(project)
+    assert load_model_classifier(model) is not clf
+
+
 def test_predict_data(test_project_with_trained_model, tmpdir):
     project = test_project_with_trained_model
 
@@ -221,6 +534,76 @@ def test_predict_data(test_project_with_trained_model, tmpdir):
             },
         )
 
+    uncertainties = DataUncertainty.objects.filter(model=project.model_set.get())
+    assert (
+        uncertainties.count() == project.data_set.filter(datalabel__isnull=True).count()
+    )
+    uncertainty = uncertainties.first()
+    probs = np.array(
+        DataPrediction.objects.filter(
+            data=uncertainty.data, model=uncertainty.model
+        ).values_list("predicted_probability", flat=True)
+    )
+    np.testing.assert_almost_equal(uncertainty.least_confident, least_confident(probs))
+    np.testing.assert_almost_equal(uncertainty.margin_sampling, margin_sampling(probs))
+    np.testing.assert_almost_equal(uncertainty.entropy, entropy(probs))
+
+
+def test_predict_data_chunked(test_project_with_trained_model, monkeypatch):
+    project = test_project_with_trained_model
+    monkeypatch.setattr("core.utils.utils_model.PREDICT_CHUNK_SIZE", 100)
+
+    predictions = predict_data(project, project.model_set.get())
+
+    num_unlabeled = project.data_set.filter(datalabel__isnull=True).count()
+    assert predictions.count() == num_unlabeled * project.labels.count()
+    assert (
+        DataUncertainty.objects.filter(model=project.model_set.get()).count()
+        == num_unlabeled
+    )
+
+
+def test_predict_data_top_k(test_project_with_trained_model):
+    project = test_project_with_trained_model
+    project.prediction_top_k = 1
+    project.save()
+    model = project.model_set.get()
+
+    predictions = predict_data(project, model)
+
+    # only the most probable label is saved for each data
+    num_unlabeled = project.data_set.filter(datalabel__isnull=True).count()
+    assert project.labels.count() > 1
+    assert predictions.count() == num_unlabeled
+    for prediction in predictions[:10]:
+        uncertainty = DataUncertainty.objects.get(data=prediction.data, model=model)
+        np.testing.assert_almost_equal(
+            prediction.predicted_probability, 1 - uncertainty.least_confident
+        )
+
+
+def test_prune_old_predictions(test_project_predicted_data):
+    project = test_project_predicted_data
+    old_model = project.model_set.get()
+    new_model = train_and_save_model(project)
+    predict_data(project, new_model)
+    num_old_rows = (
+        DataPrediction.objects.filter(model=old_model).count()
+        + DataUncertainty.objects.filter(model=old_model).count()
+    )
+    num_new_predictions = DataPrediction.objects.filter(model=new_model).count()
+
+    num_deleted = prune_old_predictions(project, keep_models=1, batch_size=100)
+
+    assert num_deleted == num_old_rows
+    assert not DataPrediction.objects.filter(model=old_model).exists()
+    assert not DataUncertainty.objects.filter(model=old_model).exists()
+    assert DataPrediction.objects.filter(model=new_model).count() == num_new_predictions
+    # the model itself is kept for its metrics
+    assert Model.objects.filter(pk=old_model.pk).exists()
+
+    assert prune_old_predictions(project, keep_models=1) == 0
+
 
 def test_check_and_trigger_model_first_labeled(
     setup_celery, test_project_data, test_labels, test_queue, test_profile
@@ -343,6 +726,128 @@ def test_check_and_trigger_batched_success(
     )
 
 
+def test_labeled_count_and_training_lock(test_project_labeled_and_tfidf, test_redis):
+    project = test_project_labeled_and_tfidf
+    training_set = project.get_current_training_set()
+    num_labeled = DataLabel.objects.filter(
+        data__project=project, training_set=training_set, data__irr_ind=False
+    ).count()
+
+    # a new counter starts from the database
+    assert incr_labeled_count(training_set) == num_labeled
+    assert incr_labeled_count(training_set) == num_labeled + 1
+    set_labeled_count(training_set, 3)
+    assert incr_labeled_count(training_set) == 4
+
+    assert acquire_training_lock(training_set)
+    assert not acquire_training_lock(training_set)
+
+
+def test_check_and_trigger_after_labeled_upload(
+    setup_celery, test_project_labeled, test_redis
+):
+    project = test_project_labeled
+    project.classifier = None
+    project.save()
+    training_set = project.get_current_training_set()
+    num_labeled = DataLabel.objects.filter(
+        data__project=project, training_set=training_set, data__irr_ind=False
+    ).count()
+    assert num_labeled >= project.batch_size
+
+    # the counter was started before the labeled upload and has not seen its labels
+    set_labeled_count(training_set, 3)
+    check = tasks.send_check_and_trigger_model_task.apply(args=[project.pk]).get()
+
+    # the batch is full, a project with a classifier would train now
+    assert check == "no action"
+    key = redis_serialize_training_set(training_set, "labeled")
+    assert int(test_redis.get(key)) == num_labeled
+
+
+def test_check_and_trigger_lock_held(
+    setup_celery, test_project_labeled_and_tfidf, test_redis
+):
+    project = test_project_labeled_and_tfidf
+    initial_training_set = project.get_current_training_set()
+    acquire_training_lock(initial_training_set)
+
+    datum = DataLabel.objects.filter(data__project=project).first().data
+    check = check_and_trigger_model(datum)
+
+    # another coder already started this round
+    assert check == "task already running"
+    assert project.model_set.count() == 0
+    assert project.get_current_training_set() == initial_training_set
+
+
+class RecordingTask:
+    """Stands in for a bound Celery task and records the states it publishes."""
+
+    def __init__(self, task_id):
+        self.request = SimpleNamespace(id=task_id)
+        self.states = []
+
+    def update_state(self, state, meta):
+        self.states.append((state, meta))
+
+
+def test_report_training_progress(test_project_labeled_and_tfidf, test_redis):
+    training_set = test_project_labeled_and_tfidf.get_current_training_set()
+    task = RecordingTask("task-1")
+    timings = {}
+
+    report_training_progress(task, training_set, "load features", timings)
+    report_training_progress(task, training_set, "predict", timings, 10, 100)
+
+    state, meta = task.states[-1]
+    assert state == "PROGRESS"
+    assert meta["stage"] == "predict"
+    assert (meta["done"], meta["total"]) == (10, 100)
+    assert list(meta["timings"]) == ["load features"]
+
+    # once superseded, the task stops at its next stage
+    test_redis.set(redis_serialize_training_set(training_set, "cancel"), "task-1")
+    with pytest.raises(Ignore):
+        report_training_progress(task, training_set, "persist", timings)
+    assert task.states[-1][0] == "REVOKED"
+
+
+def test_supersede_model_task(
+    setup_celery, test_project_labeled_and_tfidf, test_redis, tmpdir, settings
+):
+    project = test_project_labeled_and_tfidf
+    settings.MODEL_PICKLE_PATH = str(tmpdir.listdir()[0].mkdir("model_pickles"))
+    training_set = project.get_current_training_set()
+    training_set.celery_task_id = "stale-task"
+    training_set.save()
+
+    task_id = supersede_model_task(project)
+
+    assert task_id is not None
+    assert project.model_set.count() == 1
+    training_set.refresh_from_db()
+    assert training_set.celery_task_id == task_id
+    cancel_key = redis_serialize_training_set(training_set, "cancel")
+    assert test_redis.get(cancel_key) == b"stale-task"
+
+    assert get_training_progress(project) == {}
+
+
+def test_supersede_model_task_nothing_running(
+    setup_celery, test_project_labeled_and_tfidf, test_redis
+):
+    project = test_project_labeled_and_tfidf
+    training_set = project.get_current_training_set()
+
+    # with no task to cancel there is nothing to restart
+    assert supersede_model_task(project) is None
+    assert project.model_set.count() == 0
+    assert project.get_current_training_set() == training_set
+    cancel_key = redis_serialize_training_set(training_set, "cancel")
+    assert test_redis.get(cancel_key) is None
+
+
 def test_check_and_trigger_batched_onlyone_label(
     setup_celery, test_project_data, test_labels, test_queue, test_profile
 ):
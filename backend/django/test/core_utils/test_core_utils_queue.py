@@ -6,8 +6,10 @@ from core.utils.utils_queue import (
     add_queue,
     fill_queue,
     find_queue_length,
+    get_eligible_queue_keys,
     get_nonempty_queue,
     pop_first_nonempty_queue,
+    pop_nonempty_queues,
     pop_queue,
 )
 from core.utils.utils_redis import get_ordered_data, init_redis
@@ -324,3 +326,40 @@ def test_fill_queue_entropy_predicted_data(
         assert_obj_exists(DataUncertainty, {"data": datum})
         assert datum.datauncertainty_set.get().entropy <= previous_e
         previous_e = datum.datauncertainty_set.get().entropy
+
+
+def test_eligible_queue_keys_cached_until_queues_change(
+    db,
+    test_project_data,
+    test_queue,
+    test_profile,
+    test_redis,
+    django_assert_num_queries,
+):
+    assert get_eligible_queue_keys(test_project_data, profile=test_profile) == [
+        "queue:" + str(test_queue.pk)
+    ]
+    with django_assert_num_queries(0):
+        get_eligible_queue_keys(test_project_data, profile=test_profile)
+
+    profile_queue = add_queue(test_project_data, 10, profile=test_profile)
+
+    assert get_eligible_queue_keys(test_project_data, profile=test_profile) == [
+        "queue:" + str(profile_queue.pk),
+        "queue:" + str(test_queue.pk),
+    ]
+    assert get_eligible_queue_keys(test_project_data) == ["queue:" + str(test_queue.pk)]
+
+
+def test_pop_nonempty_queues(db, test_project_data, test_queue, test_redis):
+    test_queue2 = add_queue(test_project_data, 10)
+    fill_queue(test_queue, orderby="random")
+    fill_queue(test_queue2, orderby="random")
+
+    popped = pop_nonempty_queues(test_project_data, test_queue.length + 2)
+
+    # the first queue is emptied before the second is popped
+    assert len(popped) == test_queue.length + 2
+    assert {queue_pk for queue_pk, _ in popped[: test_queue.length]} == {test_queue.pk}
+    assert {queue_pk for queue_pk, _ in popped[test_queue.length :]} == {test_queue2.pk}
+    assert all(isinstance(data_pk, int) for _, data_pk in popped)
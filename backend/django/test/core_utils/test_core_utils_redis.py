@@ -1,14 +1,20 @@
+import time
 from test.util import assert_obj_exists, assert_redis_matches_db, read_test_data_backend
 
 from core.models import AssignedData, Data, DataQueue, Queue
 from core.utils.util import add_data, create_project
 from core.utils.utils_queue import add_queue, fill_queue
 from core.utils.utils_redis import (
+    TASK_SLOT_TIMEOUT,
+    bump_redis_version,
+    get_redis_version,
     init_redis,
+    project_task_slot,
     redis_parse_data,
     redis_parse_list_dataids,
     redis_parse_queue,
     redis_serialize_data,
+    redis_serialize_project_tasks,
     redis_serialize_queue,
     redis_serialize_set,
 )
@@ -138,3 +144,44 @@ def test_init_redis_ignores_assigned_data(db, test_profile, test_queue, test_red
     # Make sure the assigned datum didn't get into the redis queue
     assert test_redis.llen("queue:" + str(test_queue.pk)) == test_queue.length - 1
     assert test_redis.scard("set:" + str(test_queue.pk)) == test_queue.length - 1
+
+
+def test_project_task_slot(test_project, test_redis, settings):
+    settings.PROJECT_TASK_CONCURRENCY = 1
+
+    with project_task_slot(test_project.pk) as acquired:
+        assert acquired
+        with project_task_slot(test_project.pk) as acquired_again:
+            assert not acquired_again
+        # a refused slot does not count against the project
+        assert test_redis.zcard(redis_serialize_project_tasks(test_project.pk)) == 1
+
+    assert not test_redis.exists(redis_serialize_project_tasks(test_project.pk))
+    with project_task_slot(test_project.pk) as acquired:
+        assert acquired
+
+
+def test_project_task_slot_abandoned(test_project, test_redis, settings):
+    settings.PROJECT_TASK_CONCURRENCY = 1
+    key = redis_serialize_project_tasks(test_project.pk)
+
+    # a slot held by a killed worker is freed once it is older than the timeout
+    test_redis.zadd(key, {"killed": time.time() - TASK_SLOT_TIMEOUT - 1})
+    with project_task_slot(test_project.pk) as acquired:
+        assert acquired
+        assert test_redis.zcard(key) == 1
+
+    # refused attempts do not extend a live slot
+    test_redis.zadd(key, {"running": time.time()})
+    test_redis.expire(key, 60)
+    with project_task_slot(test_project.pk) as acquired:
+        assert not acquired
+    assert test_redis.ttl(key) <= 60
+
+
+def test_redis_version(test_redis):
+    version = get_redis_version("test:version")
+    assert get_redis_version("test:version") == version
+
+    bump_redis_version("test:version")
+    assert get_redis_version("test:version") != version
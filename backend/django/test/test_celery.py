@@ -11,6 +11,7 @@ from core.utils.utils_annotate import (
     get_assignments,
     label_data,
 )
+from core.utils.utils_model import read_tfidf_manifest
 from core.utils.utils_queue import fill_queue
 from core.utils.utils_redis import get_ordered_data, redis_serialize_queue
 
@@ -104,10 +105,26 @@ def test_tfidf_creation_task(test_project_data, tmpdir, settings):
 
     assert os.path.isfile(file)
     assert file == os.path.join(
-        str(data_temp), "project_" + str(test_project_data.pk) + "_tfidf_matrix.pkl"
+        str(data_temp),
+        "project_" + str(test_project_data.pk) + "_tfidf_matrix",
+        "manifest.json",
     )
 
 
+def test_tfidf_creation_task_refit(test_project_labeled_and_tfidf):
+    project = test_project_labeled_and_tfidf
+    old_manifest = read_tfidf_manifest(project.pk)
+
+    # nothing new was uploaded, so only an explicit refit fits a new vectorizer
+    tasks.send_tfidf_creation_task.delay(project.pk).get()
+    assert read_tfidf_manifest(project.pk) == old_manifest
+
+    tasks.send_tfidf_creation_task.delay(project.pk, refit=True).get()
+    manifest = read_tfidf_manifest(project.pk)
+    assert manifest["vectorizer_version"] == old_manifest["vectorizer_version"] + 1
+    assert manifest["data_count"] == old_manifest["data_count"]
+
+
 def test_model_task_redis_no_dupes_data_left_in_queue(
     test_project_labeled_and_tfidf,
     test_queue_labeled,
@@ -1,9 +1,15 @@
 import math
 
 from core.models import Data, DataLabel, DataQueue, IRRLog
-from core.utils.utils_annotate import assign_datum, label_data, skip_data
+from core.utils.utils_annotate import (
+    assign_datum,
+    label_data,
+    skip_data,
+    unassign_datum,
+)
 from core.utils.utils_model import check_and_trigger_model
-from core.utils.utils_queue import fill_queue
+from core.utils.utils_queue import fill_queue, get_irr_candidates
+from core.utils.utils_redis import init_redis
 
 
 def test_fill_half_irr_queues(
@@ -348,3 +354,40 @@ def test_all_irr(
         DataLabel.objects.filter(data__in=[datum3, second_datum3, third_datum3]).count()
         == 0
     )
+
+
+def test_irr_candidates_per_profile(
+    setup_celery,
+    test_project_half_irr_data,
+    test_half_irr_all_queues,
+    test_profile,
+    test_profile2,
+    test_redis,
+    tmpdir,
+    settings,
+):
+    """Check that every coder walks the IRR queue in the same order, skipping the data
+    they were already given, and that unassigned data can be given again."""
+    project = test_project_half_irr_data
+    normal_queue, admin_queue, irr_queue = test_half_irr_all_queues
+    fill_queue(
+        normal_queue, "random", irr_queue, project.percentage_irr, project.batch_size
+    )
+
+    first = get_irr_candidates(project, test_profile, 2)
+    assert len(first) == 2
+    assert {queue_pk for queue_pk, _ in first} == {irr_queue.pk}
+    assert get_irr_candidates(project, test_profile2, 2) == first
+    second = get_irr_candidates(project, test_profile, 2)
+    assert set(first).isdisjoint(second)
+
+    datum = assign_datum(test_profile2, project, "irr")
+    assert datum.pk == second[0][1]
+    unassign_datum(datum, test_profile2)
+    assert assign_datum(test_profile2, project, "irr").pk == datum.pk
+
+    # the seen data is rebuilt from the assignments, labels and skips
+    init_redis()
+    remaining = get_irr_candidates(project, test_profile2, irr_queue.length)
+    assert datum.pk not in [data_pk for _, data_pk in remaining]
+    assert len(remaining) == irr_queue.data.count() - 1